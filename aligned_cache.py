@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:48:31 2026
+
+@author: rhmooers
+"""
+
+##### Cache of the Aligned, Cloud-Masked GEOS-CF and TROPOMI Arrays #####
+
+# GeosCF_Tropomi_Read returns the same seven arrays every time its inputs...
+# ...are unchanged, so its outputs are saved once as .npy files and...
+# ...memory-mapped on later runs instead of re-reading and re-masking
+# the cache key is a hash of the input files (the three GEOS-CF afternoon...
+# ...averages and every TROPOMI file), their modification times and sizes...
+# ...and the read parameters, so changing, adding or removing any input...
+# ...file makes a new entry and the stale entry is removed
+
+import numpy as np
+import xarray as xr
+import hashlib
+import json
+import os
+import shutil
+import reading_and_processing_data as read
+
+
+# default directory of the cache
+read_cache_path = read.cache_path
+
+# increased when GeosCF_Tropomi_Read changes what it returns...
+# ...so entries written by older code are not used
+read_cache_version = 2
+
+# names of the seven arrays returned by GeosCF_Tropomi_Read
+read_names = ('tropomi_col_no2', 'geoscf_col_no2', 'geoscf_surf_no2',
+              'geoscf_temp', 'geoscf_col_no2_masked',
+              'geoscf_surf_no2_masked', 'geoscf_temp_masked')
+
+
+# function to list the input files of GeosCF_Tropomi_Read
+# the afternoon average stores (or the older pickles) and TROPOMI files
+def Read_Inputs(geoscf_files_path, tropomi_files_path):
+    inputs = []
+    for name in ('no2', 'column', 'temp'):
+        path = geoscf_files_path+'geocf_afternoon_ave_'+name+'.nc'
+        if not os.path.exists(path):
+            path = geoscf_files_path+'geocf_afternoon_ave_'+name+'.pkl'
+        inputs.append(path)
+    inputs += sorted(os.path.join(tropomi_files_path, x)
+                     for x in os.listdir(tropomi_files_path)
+                     if x.endswith('.nc'))
+    return inputs
+
+
+# function to hash a json-serialisable object
+def Hash(obj):
+    return hashlib.sha256(json.dumps(obj).encode()).hexdigest()[:16]
+
+
+# function to give a json-serialisable stand-in for a read parameter
+# arrays (e.g. extra_masks) are given by their shape, dimensions and a...
+# ...sha256 checksum of their values and coordinates, since repr()...
+# ...abbreviates large arrays and two different masks can share one
+def Parameter_Key(value):
+    if isinstance(value, (list, tuple)):
+        return [Parameter_Key(x) for x in value]
+    if isinstance(value, (np.ndarray, xr.DataArray)):
+        digest = hashlib.sha256(np.ascontiguousarray(value).tobytes())
+        dims = []
+        if isinstance(value, xr.DataArray):
+            dims = list(value.dims)
+            for name in sorted(value.coords):
+                digest.update(name.encode())
+                digest.update(np.ascontiguousarray(
+                    value[name].values).tobytes())
+        return [str(value.dtype), list(value.shape), dims,
+                digest.hexdigest()]
+    return repr(value)
+
+
+# function to give the cache directory for a pair of input paths and...
+# ...the key of the current state of their files
+# entries for other inputs (e.g. a test directory) or other read_kwargs...
+# ...(the parameters passed on to GeosCF_Tropomi_Read) have their own...
+# ...directory, so they do not invalidate each other
+def Read_Cache_Key(geoscf_files_path, tropomi_files_path,
+                   cache_path=read_cache_path, read_kwargs={}):
+    parameters = {x: Parameter_Key(y) for x, y in read_kwargs.items()
+                  if x not in ('n_workers', 'catalogue_file')}
+    paths = [read_cache_version, os.path.abspath(geoscf_files_path),
+             os.path.abspath(tropomi_files_path), parameters]
+    files = []
+    for path in Read_Inputs(geoscf_files_path, tropomi_files_path):
+        file_stat = os.stat(path)
+        files.append([os.path.basename(path), file_stat.st_mtime_ns,
+                      file_stat.st_size])
+    return os.path.join(cache_path, Hash(paths)), Hash(files)
+
+
+# function to save the seven arrays as an entry of the cache
+# each array is saved as <name>.npy with its coordinates in...
+# ...<name>_coords.npz, and its name and dimensions in entry.json
+# the entry is written to a temporary directory and renamed when...
+# ...complete, so an interrupted run never leaves a partial entry
+def Save_Entry(entry_path, arrays):
+    tmp_path = entry_path+'.tmp'+str(os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    meta = {}
+    for name, array in zip(read_names, arrays):
+        np.save(os.path.join(tmp_path, name+'.npy'), array.values)
+        np.savez(os.path.join(tmp_path, name+'_coords.npz'),
+                 **{dim: array[dim].values for dim in array.dims})
+        meta[name] = {'name': array.name, 'dims': list(array.dims)}
+    with open(os.path.join(tmp_path, 'entry.json'), 'w') as file_out:
+        json.dump(meta, file_out, indent=1)
+
+    try:
+        os.rename(tmp_path, entry_path)
+    except OSError:
+        # another run saved the same entry first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+# function to open the seven arrays of a cache entry
+# values are memory-mapped (copy-on-write), so only the parts...
+# ...that are used are read from disk
+def Load_Entry(entry_path):
+    with open(os.path.join(entry_path, 'entry.json')) as file_in:
+        meta = json.load(file_in)
+    arrays = []
+    for name in read_names:
+        values = np.load(os.path.join(entry_path, name+'.npy'),
+                         mmap_mode='c')
+        with np.load(os.path.join(entry_path, name+'_coords.npz')) as coords:
+            coords = [(dim, coords[dim]) for dim in meta[name]['dims']]
+        arrays.append(xr.DataArray(values, coords=coords,
+                                   name=meta[name]['name']))
+    return arrays
+
+
+# function returning the outputs of GeosCF_Tropomi_Read from the cache
+# GeosCF_Tropomi_Read is only run (and its outputs saved) when no entry...
+# ...matches the current input files, otherwise the saved arrays are...
+# ...memory-mapped, which takes seconds instead of the full read
+# lazy returns chunked dask arrays as GeosCF_Tropomi_Read(lazy=True) does
+# read_kwargs are passed on to GeosCF_Tropomi_Read
+def GeosCF_Tropomi_Cached_Read(geoscf_files_path, tropomi_files_path,
+                               lazy=False, cache_path=read_cache_path,
+                               **read_kwargs):
+
+    inputs_path, key = Read_Cache_Key(geoscf_files_path, tropomi_files_path,
+                                      cache_path, read_kwargs)
+    entry_path = os.path.join(inputs_path, key)
+
+    if not os.path.exists(entry_path):
+        arrays = read.GeosCF_Tropomi_Read(geoscf_files_path,
+                                          tropomi_files_path,
+                                          **read_kwargs)
+        os.makedirs(inputs_path, exist_ok=True)
+        Save_Entry(entry_path, arrays)
+
+        # removing entries for earlier versions of the input files
+        for name in os.listdir(inputs_path):
+            if name != key and '.tmp' not in name:
+                shutil.rmtree(os.path.join(inputs_path, name),
+                              ignore_errors=True)
+
+    arrays = Load_Entry(entry_path)
+    if lazy:
+        arrays = [array.chunk({'date': read.lazy_days}) for array in arrays]
+    return tuple(arrays)
+
+
+# testing cached reading function
+'''
+(tropomi_col_no2, geoscf_col_no2, geoscf_surf_no2, geoscf_temp, geoscf_col_no2_masked,
+ geoscf_surf_no2_masked, geoscf_temp_masked) = GeosCF_Tropomi_Cached_Read(
+     '/projectnb/atmchem/shared/geocf_usa/',
+     '/projectnb/atmchem/shared/tropomi/tropomi_pal/conus/gridded_geoscf')
+'''
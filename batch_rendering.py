@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:36:40 2026
+
+@author: rhmooers
+"""
+
+##### Parallel Rendering of Batches of Map Figures to Files #####
+
+# renders many one- or two-panel lat/lon maps (e.g. the twelve monthly...
+# ...averages of a year) in worker processes, writing each straight to...
+# ...a file without opening a window
+# figures are drawn with matplotlib's Agg canvas directly (no pyplot)...
+# ...so the workers are headless whatever backend the session uses
+# each worker builds the axes, colour meshes, colorbars and the...
+# ...state/province boundary lines once for each layout and only...
+# ...replaces the data, colours and titles for each frame
+# matplotlib is only imported by the workers, so building frames and...
+# ...importing this module stay cheap
+
+import numpy as np
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+# number of worker processes rendering figures
+render_workers = min(8, os.cpu_count() or 1)
+
+# state of each worker, set by Worker_Start
+worker_grid = {}
+worker_layouts = {}
+
+
+# function to give the rings of polygons as a list of (n, 2) lon/lat...
+# ...arrays, light enough to send to every worker
+def Polygon_Lines(geometries):
+    lines = []
+    for geometry in geometries:
+        polygons = getattr(geometry, 'geoms', [geometry])
+        for polygon in polygons:
+            lines.append(np.asarray(polygon.exterior.coords)[:, :2])
+            for ring in polygon.interiors:
+                lines.append(np.asarray(ring.coords)[:, :2])
+    return lines
+
+
+# function to give the boundary lines of a GeoDataFrame of polygons...
+# ...(e.g. Shapefile_Read(..., simplify='conus'))
+def Boundary_Lines(states):
+    return Polygon_Lines(states.geometry.values)
+
+
+# function to give the outline of each country of Shapefile_Read: the...
+# ...coastlines and international borders, drawn over the state and...
+# ...province boundaries in place of Basemap's coastlines and countries
+# the states of a country are a coverage, so their union is exact
+def Country_Lines(states):
+    import shapely
+
+    outlines = []
+    for country in states['country'].unique():
+        rows = (states['country'] == country).values
+        outlines.append(shapely.coverage_union_all(
+            states.geometry.values[rows]))
+    return Polygon_Lines(outlines)
+
+
+# function run once in each worker, keeping the grid and boundaries
+def Worker_Start(lat, lon, extent, boundary_lines, country_lines, dpi):
+    worker_grid.update({'lat': lat, 'lon': lon, 'extent': extent,
+                        'boundary_lines': boundary_lines,
+                        'country_lines': country_lines, 'dpi': dpi})
+
+
+# function to build a figure of n_panels maps side by side
+# returns the figure and for each panel its axes, mesh and colorbar
+def Map_Layout(n_panels):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+
+    lat = worker_grid['lat']
+    lon = worker_grid['lon']
+    min_lon, min_lat, max_lon, max_lat = worker_grid['extent']
+
+    figure = Figure(figsize=(7 * n_panels, 4.5))
+    FigureCanvasAgg(figure)
+    panels = []
+    for i in range(n_panels):
+        axes = figure.add_subplot(1, n_panels, i+1)
+        mesh = axes.pcolormesh(lon, lat, np.zeros((len(lat), len(lon))),
+                               shading='nearest')
+        axes.add_collection(LineCollection(worker_grid['boundary_lines'],
+                                           colors='k', linewidths=0.4))
+        axes.add_collection(LineCollection(worker_grid['country_lines'],
+                                           colors='k', linewidths=0.9))
+        axes.set_xlim(min_lon, max_lon)
+        axes.set_ylim(min_lat, max_lat)
+        axes.set_aspect('equal')
+        colorbar = figure.colorbar(mesh, ax=axes, orientation='horizontal',
+                                   pad=0.06, fraction=0.05)
+        panels.append((axes, mesh, colorbar))
+    return figure, panels
+
+
+# function to render one frame in a worker
+# the layout for the frame's number of panels is built on first use...
+# ...and reused by every later frame with the same number of panels
+def Render_Frame(frame):
+    import matplotlib
+
+    n_panels = len(frame['panels'])
+    if n_panels not in worker_layouts:
+        worker_layouts[n_panels] = Map_Layout(n_panels)
+    figure, panels = worker_layouts[n_panels]
+
+    for (axes, mesh, colorbar), panel in zip(panels, frame['panels']):
+        mesh.set_array(np.ma.masked_invalid(
+            np.asarray(panel['values'], dtype=np.float64)).ravel())
+        mesh.set_cmap(matplotlib.colormaps[panel.get('cmap', 'Spectral_r')]
+                      .resampled(panel.get('levels', 30)))
+        mesh.set_clim(panel['vmin'], panel['vmax'])
+        axes.set_title(panel.get('title', ''))
+        colorbar.set_label(panel.get('label', ''))
+    figure.suptitle(frame.get('title', ''))
+    figure.savefig(frame['filename'], dpi=worker_grid['dpi'])
+    return frame['filename']
+
+
+# function to give the frame of a figure from its panels
+# each panel is (values, title, vmin, vmax, label), values a lat x lon...
+# ...DataArray or array, cmap and levels are those of all the figures...
+# ...(Spectral_r in 30 colours)
+def Map_Frame(filename, title, *panels, cmap='Spectral_r', levels=30):
+    return {'filename': filename, 'title': title,
+            'panels': [{'values': np.asarray(values), 'title': panel_title,
+                        'vmin': vmin, 'vmax': vmax, 'label': label,
+                        'cmap': cmap, 'levels': levels}
+                       for values, panel_title, vmin, vmax, label in panels]}
+
+
+# function to render frames to files in parallel
+# each frame is a dict with the filename, a title and a list of one or...
+# ...two panels, each a dict with values (a lat x lon array), vmin, vmax...
+# ...and optionally title, cmap (name), levels and label (colorbar)
+# lat and lon are the grid of the values, extent is (min_lon, min_lat,...
+# ...max_lon, max_lat), boundary_lines from Boundary_Lines and...
+# ...country_lines (drawn heavier) from Country_Lines
+# maps are drawn on plain lat/lon axes, not a map projection
+# returns the filenames written, in the order of the frames
+def Render_Frames(frames, lat, lon, extent=(-126, 25, -60, 53),
+                  boundary_lines=(), country_lines=(),
+                  n_workers=render_workers, dpi=150):
+
+    for frame in frames:
+        directory = os.path.dirname(frame['filename'])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # workers are forked where possible so they start without...
+    # ...re-importing the calling script
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods
+                                          else None)
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=context,
+                             initializer=Worker_Start,
+                             initargs=(np.asarray(lat), np.asarray(lon),
+                                       extent, list(boundary_lines),
+                                       list(country_lines), dpi)) as pool:
+        return list(pool.map(Render_Frame, frames))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:36:12 2026
+
+@author: rhmooers
+"""
+
+##### Co-location Masking of GEOS-CF by TROPOMI #####
+
+# GEOS-CF values are kept only where the reference (TROPOMI) has data...
+# ...and any additional masks (e.g. a QA threshold or land cover) are True
+# the validity mask is built once, as a single boolean array, and applied...
+# ...to every variable in one pass, writing either into the variable's own...
+# ...array (in place) or into one preallocated output buffer per variable
+
+import numpy as np
+import xarray as xr
+
+
+# function to give an extra mask the shape of the reference for broadcasting
+# masks may cover only some of the reference dimensions (e.g. a lat/lon...
+# ...land mask for a date/lat/lon array), missing dimensions get length 1...
+# ...so no full-size copy of the mask is made
+def Broadcast_Mask(mask, reference):
+    if not isinstance(mask, xr.DataArray):
+        return np.asarray(mask, dtype=bool)
+    for dim in mask.dims:
+        if dim not in reference.dims:
+            raise ValueError('mask dimension '+dim+
+                             ' is not a dimension of the reference')
+    mask = mask.transpose(*[x for x in reference.dims if x in mask.dims])
+    shape = [mask.sizes[x] if x in mask.dims else 1 for x in reference.dims]
+    return np.reshape(mask.values.astype(bool, copy=False), shape)
+
+
+# function to mask variables where the reference is NaN
+# reference is a DataArray (e.g. TROPOMI column NO2) and variables a dict...
+# ...of {name: DataArray} on the same grid (e.g. cropped GEOS-CF arrays)
+# extra_masks are boolean arrays, True where data is kept
+# in_place writes NaN into the variables' own arrays, otherwise each...
+# ...variable is copied once into a new buffer (float32 if float32=True)
+# returns a Dataset of the masked variables
+# dask (lazy) inputs return lazily masked variables instead
+def Colocation_Mask(reference, variables, extra_masks=(), in_place=False,
+                    float32=False):
+
+    for name, variable in variables.items():
+        if variable.dims != reference.dims or variable.shape != (
+                reference.shape):
+            raise ValueError(name+' '+str(dict(variable.sizes))+
+                             ' is not on the grid of the reference '+
+                             str(dict(reference.sizes)))
+        for dim in reference.dims:
+            if not np.array_equal(variable[dim].values,
+                                  reference[dim].values):
+                raise ValueError(name+' has different '+dim+
+                                 ' coordinates from the reference')
+
+    coords = {dim: reference[dim].values for dim in reference.dims}
+
+    # lazily evaluated arrays are masked chunk by chunk when computed
+    if reference.chunks is not None or any(
+            x.chunks is not None for x in variables.values()):
+        valid = reference.notnull()
+        for mask in extra_masks:
+            valid = valid & mask
+        masked = {}
+        for name, variable in variables.items():
+            variable = variable.where(valid)
+            if float32:
+                variable = variable.astype(np.float32)
+            masked[name] = (reference.dims, variable.data)
+        return xr.Dataset(masked, coords=coords)
+
+    # one boolean array, True where data is kept, combined with the extra...
+    # ...masks and then inverted in place (True where data is removed)
+    invalid = np.isnan(reference.values)
+    np.logical_not(invalid, out=invalid)
+    for mask in extra_masks:
+        np.logical_and(invalid, Broadcast_Mask(mask, reference), out=invalid)
+    np.logical_not(invalid, out=invalid)
+
+    masked = {}
+    for name, variable in variables.items():
+        if in_place:
+            # loading first so the variable keeps the array masked here
+            values = variable.load().values
+        else:
+            values = np.empty(variable.shape, dtype=np.float32 if float32
+                              else np.result_type(variable.dtype, np.float32))
+            values[...] = variable.values
+        np.copyto(values, np.nan, where=invalid)
+        masked[name] = (reference.dims, values)
+
+    return xr.Dataset(masked, coords=coords)
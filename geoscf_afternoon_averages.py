@@ -11,23 +11,25 @@ Created on Tue Aug  1 13:59:22 2023
 # extracting 12pm to 3pm local time to obtain daily "afternoon averages" 
 # note that since the model is in UTC there will be missing local time...
  # ...data on the last day of data 
+# in streaming mode each month is read with a few hours of the next...
+# ...month so only the last day of the whole record can be incomplete 
 
 import numpy as np  
 import xarray as xr
-import pandas as pd
 import calendar 
 import pickle
 import os, fnmatch
+import json
+import hashlib
+import netCDF4
 from pathlib import Path
-import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
-from datetime import datetime, timedelta
+import geoscf_store as gs
+import geoscf_data_pull as gdp
+import time_concat as tc
 
-# reading in latitude and longitude arrays 
+# latitude and longitude arrays of the older pickle files 
 url_dir = "https://opendap.nccs.nasa.gov/dods/gmao/geos-cf/assim/"
 url_aqc = "aqc_tavg_1hr_g1440x721_v1"
-url = url_dir + url_aqc 
-ds = xr.open_dataset(url)
 
 # Decide on up your lat/lon slice boundaries
 min_lon = -126
@@ -35,45 +37,50 @@ min_lat = 25
 max_lon = -60
 max_lat = 60
 
-# date to extract lat/lon arrays from 
-# arbitrary since it is equal for all dates 
-y = 2018
-m = 2
-d_last = 2
-
-first_datestring = str(y)+'-'+str(m).zfill(2)+'-'+'01'
-last_datestring = str(y)+'-'+str(m).zfill(2)+'-'+str(
-    d_last).zfill(2)
+# function to read the latitude and longitude arrays from the server 
+# only needed for the pickle files, the stores carry their own 
+def opendap_lat_lon(): 
+    url = url_dir + url_aqc 
+    ds = xr.open_dataset(url)
+    
+    # date to extract lat/lon arrays from 
+    # arbitrary since it is equal for all dates 
+    y = 2018
+    m = 2
+    d_last = 2
+    
+    first_datestring = str(y)+'-'+str(m).zfill(2)+'-'+'01'
+    last_datestring = str(y)+'-'+str(m).zfill(2)+'-'+str(
+        d_last).zfill(2)
+    
+    # Retrieve the output over the area slice for NO2:
+    no2 = ds.no2.sel(lon=slice(min_lon, max_lon), 
+                     lat=slice(min_lat, max_lat), 
+                     time=slice(first_datestring, 
+                                last_datestring))
+    
+    # storing latitude and lonigitude values in numpy arrays 
+    return no2.lat.values, no2.lon.values
 
-# Retrieve the output over the area slice for NO2:
-no2 = ds.no2.sel(lon=slice(min_lon, max_lon), 
-                 lat=slice(min_lat, max_lat), 
-                 time=slice(first_datestring, 
-                            last_datestring))
 
-# storing latitude and lonigitude values in numpy arrays 
-lat_array = no2.lat.values
-lon_array = no2.lon.values
+################# Reading in GEOS-CF NO2 and Temperature Data ################
 
+# process one month at a time from the variable stores written by...
+# ...geoscf_data_pull.py, holding about one month of one variable in...
+# ...memory (see afternoon_stream below), rather than the whole record 
+# the older monthly pickle files can only be processed as a whole record 
+streaming = True
 
-################# Reading in GEOS-CF NO2 and Temperature Data ################
+# directory of the data files, where geoscf_data_pull.py writes the stores 
+geoscf_usa_path = Path(gdp.out_dir)
 
-# grouping data files by variable 
-geoscf_usa_path = Path('/projectnb/atmchem/shared/geocf_usa')
-no2_files = geoscf_usa_path.glob('*no2usa*')
-column_files = geoscf_usa_path.glob('*trpcolusa*')
-temp_files = geoscf_usa_path.glob('*t10usa*')
-
-# saving filepaths as strings in lists 
-no2_filelist = [] # to store no2 paths 
-for i in no2_files: 
-    no2_filelist.append(str(i))
-column_filelist = [] # to store col no2 paths 
-for i in column_files: 
-    column_filelist.append(str(i))
-temp_filelist = [] # to store temperature paths 
-for i in temp_files: 
-    temp_filelist.append(str(i))
+# a variable store written by geoscf_data_pull.py replaces...
+# ...the older monthly pickle files of that variable 
+def store_or_pickles(filelist): 
+    stores = [x for x in filelist if x.endswith('.nc')]
+    if stores: 
+        return stores
+    return [x for x in filelist if x.endswith('.pkl')]
 
 # sorting filenames into temporal order 
 def filename_sort(filelist):
@@ -82,33 +89,65 @@ def filename_sort(filelist):
         filelist_sorted.append(x)
     return filelist_sorted
 
-# this sorts the path names by dates in the lists 
-no2_filelist = filename_sort(no2_filelist)
-column_filelist = filename_sort(column_filelist)
-temp_filelist = filename_sort(temp_filelist)
+# function to list the data files of each variable, sorted by date 
+def variable_filelists(): 
+    
+    # grouping data files by variable 
+    no2_files = geoscf_usa_path.glob('*no2usa*')
+    column_files = geoscf_usa_path.glob('*trpcolusa*')
+    temp_files = geoscf_usa_path.glob('*t10usa*')
+    
+    # saving filepaths as strings in lists 
+    no2_filelist = [] # to store no2 paths 
+    for i in no2_files: 
+        no2_filelist.append(str(i))
+    column_filelist = [] # to store col no2 paths 
+    for i in column_files: 
+        column_filelist.append(str(i))
+    temp_filelist = [] # to store temperature paths 
+    for i in temp_files: 
+        temp_filelist.append(str(i))
+    
+    no2_filelist = store_or_pickles(no2_filelist)
+    column_filelist = store_or_pickles(column_filelist)
+    temp_filelist = store_or_pickles(temp_filelist)
+    
+    # this sorts the path names by dates in the lists 
+    return (filename_sort(no2_filelist), filename_sort(column_filelist), 
+            filename_sort(temp_filelist))
 
 # function to store data as dictionaries in lists 
-def data_dictionary_store(file_list):
+# a monthly pickle file gives one dictionary, a store gives one dictionary...
+# ...for its whole record, using the same keys as the pickle files 
+# time_window (e.g. slice('2020-01-01', '2020-03-31')) reads only...
+# ...part of a store 
+def data_dictionary_store(file_list, time_window=None):
     dict_list = []
     for string_path in file_list:
         path = os.path.abspath(string_path)
-        dict_list.append(pickle.load(open(path, "rb")))
+        if path.endswith('.nc'): 
+            store = gs.store_open(path)
+            array = store.sel(time=time_window or slice(None))
+            arr_key, dat_key = gs.pickle_keys[array.name]
+            dict_list.append({arr_key: array.values, 
+                              dat_key: array.time.values.astype(
+                                  'datetime64[s]'), 
+                              'lat': array.lat.values, 
+                              'lon': array.lon.values})
+            store.close()
+        else: 
+            with open(path, "rb") as file_in: 
+                dict_list.append(pickle.load(file_in))
     return dict_list
 
-# storing the data 
-no2_list = data_dictionary_store(no2_filelist)
-column_list = data_dictionary_store(column_filelist)
-temp_list = data_dictionary_store(temp_filelist)
-
 
 ######################## Converting Data to Xarray ###########################
 
-# latitude and longitude as lists for xarray dimensions
-lat_list = np.ndarray.tolist(lat_array)
-lon_list = np.ndarray.tolist(lon_array)
-
 # function to convert dictionaries in list to xarrays in list
-def dict_to_array(data_list, date_key, data_key):
+# dictionaries read from a store carry their own lat and lon, the...
+# ...pickle files use lat_list and lon_list 
+def dict_to_array(data_list, date_key, data_key, lat_list=None, 
+                  lon_list=None):
     array_list = []
     for i in range(len(data_list)):
         times = np.ndarray.tolist(
@@ -116,273 +155,289 @@ def dict_to_array(data_list, date_key, data_key):
         data_array = xr.DataArray(
             data_list[i].get(data_key), 
             coords=[("time", times,), 
-                    ("lat", lat_list), 
-                    ("lon", lon_list)])
+                    ("lat", data_list[i].get('lat', lat_list)), 
+                    ("lon", data_list[i].get('lon', lon_list))])
         array_list.append(data_array)   
     return array_list
 
-# converting no2, temp, and column dictionaries to xarrays 
-no2_array_list = dict_to_array(no2_list, 
-                               'no2_dat', 'no2_arr')
-column_array_list = dict_to_array(column_list, 
-                                  'no2_dat', 'no2_arr')
-temp_array_list = dict_to_array(temp_list, 
-                                't10_dat', 't10_arr')
-
-# concatenating along time axes to obtain a single xarray for each variable 
-no2_array = no2_array_list[0]
-for i in range(1, len(no2_array_list)): 
-    no2_array =  xr.concat([no2_array, 
-                            no2_array_list[i]], 
-                           dim='time')
-
-column_array = column_array_list[0]
-for i in range(1, len(column_array_list)): 
-    column_array =  xr.concat([column_array, 
-                               column_array_list[i]], 
-                              dim='time')
-
-temp_array = temp_array_list[0]
-for i in range(1, len(temp_array_list)): 
-    temp_array = xr.concat([temp_array,
-                            temp_array_list[i]], 
-                           dim='time')
-    
     
 ############# UTC to Local Time Conversions based on Longitude ###############
 
-# Convention for time adjustments:  
-# -60 +- 7.5 degrees (52.5-67.5) = UTC - 4   
-# -75 +- 7.5 degrees (67.5-82.5) = UTC - 5   
-# -90 +- 7.5 degrees (82.5-97.5) = UTC - 6  
-# -105 +- 7.5 degrees (97.5-112.5) = UTC - 7   
-# -120 +- 7.5 degrees (112.5-127.5) = UTC - 8  
+# the UTC offset of each longitude is gdp.utc_offset, shared with the...
+# ...hour selection of the pull (see geoscf_data_pull.py for the zones) 
+
+# function to give the local time of every (time, lon) pair 
+# as whole hours since 1970-01-01 local time, shape (time, lon) 
+# GEOS-CF hourly averages are stamped at half past the hour...
+# ...so each one falls within the local hour it is counted in 
+def local_hours(times, lon): 
+    utc_hours = np.asarray(times).astype('datetime64[h]').astype(np.int64)
+    return utc_hours[:, None] + gdp.utc_offset(lon)[None, :]
 
 # function to change times from UTC to local 
-# splits the array into smaller arrays, each with respective local times
+# the UTC offset of each longitude is computed once and every value is...
+# ...moved to its local date and hour in a single indexed assignment 
+# output is one array with dimensions (date, hour, lat, lon) in local time 
+# local hours with no data (at the start and end of the record) are NaN 
+# for the afternoon averages see afternoon_average, which only gathers...
+# ...the afternoon hours instead of all 24 
 def time_adjust(array): 
     
-    timezone1 = array.sel(lon=slice(-126., -112.5)) # UTC - 8
-    adjustedtime1 = []
-    for j in range(len(timezone1.time.values)): 
-        timestamp = timezone1.time.values[j]
-        timestamp = datetime.utcfromtimestamp(int(timestamp)/1e9)
-        new_time = timestamp - timedelta(hours = 8)
-        adjustedtime1.append(new_time)
-
-    timezone2 = array.sel(lon=slice(-112.25, -97.5)) # UTC - 7
-    adjustedtime2 = []
-    for j in range(len(timezone2.time.values)): 
-        timestamp = timezone2.time.values[j]
-        timestamp = datetime.utcfromtimestamp(int(timestamp)/1e9)
-        new_time = timestamp - timedelta(hours = 7)
-        adjustedtime2.append(new_time)
-
-    timezone3 = array.sel(lon=slice(-97.25, -82.5)) # UTC - 6 
-    adjustedtime3 = []
-    for j in range(len(timezone3.time.values)): 
-        timestamp = timezone3.time.values[j]
-        timestamp = datetime.utcfromtimestamp(int(timestamp)/1e9)
-        new_time = timestamp - timedelta(hours = 6)
-        adjustedtime3.append(new_time)
-
-    timezone4 = array.sel(lon=slice(-82.25, -67.5)) # UTC - 5
-    adjustedtime4 = []
-    for j in range(len(timezone4.time.values)): 
-        timestamp = timezone4.time.values[j]
-        timestamp = datetime.utcfromtimestamp(int(timestamp)/1e9)
-        new_time = timestamp - timedelta(hours = 5)
-        adjustedtime4.append(new_time)
-
-    timezone5 = array.sel(lon=slice(-67.25, -60.)) # UTC - 4
-    adjustedtime5 = []
-    for j in range(len(timezone5.time.values)): 
-        timestamp = timezone5.time.values[j]
-        timestamp = datetime.utcfromtimestamp(int(timestamp)/1e9)
-        new_time = timestamp - timedelta(hours = 4)
-        adjustedtime5.append(new_time)
-    
-    # splitting lat and lon values to re-attatch to arrays 
-    lat1 = np.ndarray.tolist(timezone1.coords['lat'].values)
-    lon1 = np.ndarray.tolist(timezone1.coords['lon'].values)
-    
-    lat2 = np.ndarray.tolist(timezone2.coords['lat'].values)
-    lon2 = np.ndarray.tolist(timezone2.coords['lon'].values)
-    
-    lat3 = np.ndarray.tolist(timezone3.coords['lat'].values)
-    lon3 = np.ndarray.tolist(timezone3.coords['lon'].values)
-    
-    lat4 = np.ndarray.tolist(timezone4.coords['lat'].values)
-    lon4 = np.ndarray.tolist(timezone4.coords['lon'].values)
-    
-    lat5 = np.ndarray.tolist(timezone5.coords['lat'].values)
-    lon5 = np.ndarray.tolist(timezone5.coords['lon'].values)
-    
-    # compiling split/adjusted data into timezone arrays 
-    timezone1 = xr.DataArray(timezone1, 
-                            coords=[("time", adjustedtime1,), 
-                            ("lat", lat1), ("lon", lon1)])
-    
-    timezone2 = xr.DataArray(timezone2, 
-                            coords=[("time", adjustedtime2,), 
-                            ("lat", lat2), ("lon", lon2)])
-    
-    timezone3 = xr.DataArray(timezone3, 
-                            coords=[("time", adjustedtime3,), 
-                            ("lat", lat3), ("lon", lon3)])
-    
-    timezone4 = xr.DataArray(timezone4, 
-                            coords=[("time", adjustedtime4,), 
-                            ("lat", lat4), ("lon", lon4)])
-    
-    timezone5 = xr.DataArray(timezone5, 
-                            coords=[("time", adjustedtime5,), 
-                            ("lat", lat5), ("lon", lon5)])
-    
-    timezone_list = [timezone1, timezone2, timezone3, 
-                     timezone4, timezone5]
-    
-    return timezone_list
-
-# no2 data split by timezone
-# data is in local time
-adjusted_no2_arrays = time_adjust(no2_array)
-no2_array1 = adjusted_no2_arrays[0]
-no2_array2 = adjusted_no2_arrays[1]
-no2_array3 = adjusted_no2_arrays[2]
-no2_array4 = adjusted_no2_arrays[3]
-no2_array5 = adjusted_no2_arrays[4]
-
-# column data split by timezone and with local time 
-adjusted_column_arrays = time_adjust(column_array)
-column_array1 = adjusted_column_arrays[0]
-column_array2 = adjusted_column_arrays[1]
-column_array3 = adjusted_column_arrays[2]
-column_array4 = adjusted_column_arrays[3]
-column_array5 = adjusted_column_arrays[4]
-
-# temp data split by timezone and with local time 
-adjusted_temp_arrays = time_adjust(temp_array)
-temp_array1 = adjusted_temp_arrays[0]
-temp_array2 = adjusted_temp_arrays[1]
-temp_array3 = adjusted_temp_arrays[2]
-temp_array4 = adjusted_temp_arrays[3]
-temp_array5 = adjusted_temp_arrays[4]
-
+    local = local_hours(array.time.values, array.lon.values)
+    day = local // 24
+    hour = local % 24
+    first_day = day.min()
+    n_days = day.max() - first_day + 1
+    lon_index = np.broadcast_to(np.arange(array.sizes['lon']), 
+                                local.shape)
+    
+    local_array = np.full((n_days, 24, array.sizes['lat'], 
+                           array.sizes['lon']), np.nan, 
+                          dtype=np.result_type(array.dtype, np.float32))
+    # indexed by (time, lon) pairs, so values are given as (time, lon, lat)
+    local_array[day - first_day, hour, :, lon_index] = np.moveaxis(
+        array.transpose('time', 'lat', 'lon').values, 2, 1)
+    
+    dates = (first_day + np.arange(n_days)).astype('datetime64[D]')
+    
+    return xr.DataArray(local_array, 
+                        coords=[("date", dates.astype('datetime64[ns]')), 
+                                ("hour", np.arange(24)), 
+                                ("lat", array.lat.values), 
+                                ("lon", array.lon.values)])
 
 #################### Extracting 12pm to 3pm Local Time #######################
+
+# local hours (first, last) making up the daily "afternoon" 
+afternoon_hours = (12, 15)
     
-# function to take afternoon averages 
-# output is an xarray with daily "afternoon" (1-3pm) averages 
-def afternoon_average(array): 
-    
-    dates_list = []
-    for i in range(len(array.time.values)):
-        timestamp = array.time.values[i]
-        unix_time = timestamp.astype(datetime)
-        dt_time = datetime.fromtimestamp(unix_time/1e9)
-        dates_list.append(dt_time)   
-
-    # separating out hour of day 
-    hours = []
-    for i in range(len(array.time.values)):
-        timestamp = array.time.values[i]
-        unix_time = timestamp.astype(datetime)
-        dt_time = datetime.fromtimestamp(unix_time/1e9)
-        only_hour = dt_time.hour
-        hours.append(only_hour)
-
-    # replace time in xarray with only hour
-    array.reset_index(['time'], drop = True)
-    array.coords['time'] = hours
-    array = array.rename({'time': 'hours'})
-
-    # creating mask where 1 = afternoon times and 0 = other times
-    mask = []
-    for i in array['hours']: 
-        if i == 12 or i == 13 or i == 14 or i == 15: 
-            mask.append(1)
-        else: 
-            mask.append(0)
-
-    # replacing time in xarrays with mask  
-    array.reset_index(['hours'], drop = True)
-    array.coords['hours'] = mask
-    masked_array = array.rename({'hours': 'mask'})
-
-    # creating pandas dataframe with dates and mask 
-    dates = np.array(dates_list)
-    afternoon_df = pd.DataFrame({'Dates': dates})
-    afternoon_df['mask'] = mask 
-    afternoon_df
-
-    afternoon_dates = afternoon_df[afternoon_df['mask'] 
-                                   == 1]['Dates'].to_list()
-    print(afternoon_dates)
-
-    # filtering xarray to only afternoon 
-    array_new = masked_array[(masked_array['mask']==1)]
-
-    # replace mask coord with dates coord
-    array_new.reset_index(['mask'], drop = True)
-    array_new.coords['mask'] = afternoon_dates
-    array_new = array_new.rename({'mask': 'date'})
-
-    # using resample to take daily afternoon averages
-    afternoon_ave = array_new.resample(date='1D').mean()
-
-    return afternoon_ave
-
-# uses function to take afternoon ave of all data
-# then concatenates along longitude axis back into one array 
-
-# afternoon averages of no2 for each timezone 
-no2_ave1 = afternoon_average(no2_array1)
-no2_ave2 = afternoon_average(no2_array2)
-no2_ave3 = afternoon_average(no2_array3)
-no2_ave4 = afternoon_average(no2_array4)
-no2_ave5 = afternoon_average(no2_array5)
-
-# concatenating into a single array
-# timezone is now irrelevant...
-# ...since values are all based on local time 
-afternoon_ave_no2 = xr.concat(
-    [no2_ave1, no2_ave2, no2_ave3, no2_ave4, no2_ave5],
-    dim='lon')
-
-# afternoon averages of column no2
-column_ave1 = afternoon_average(column_array1)
-column_ave2 = afternoon_average(column_array2)
-column_ave3 = afternoon_average(column_array3)
-column_ave4 = afternoon_average(column_array4)
-column_ave5 = afternoon_average(column_array5) 
-
-# concatenating into a single array
-afternoon_ave_column = xr.concat(
-    [column_ave1, column_ave2, column_ave3, column_ave4, 
-     column_ave5], dim='lon')
-
-# afternoon temperature averages 
-temp_ave1 = afternoon_average(temp_array1)
-temp_ave2 = afternoon_average(temp_array2)
-temp_ave3 = afternoon_average(temp_array3)
-temp_ave4 = afternoon_average(temp_array4)
-temp_ave5 = afternoon_average(temp_array5)
-
-# concatenating into a single array
-afternoon_ave_temp = xr.concat(
-    [temp_ave1, temp_ave2, temp_ave3, temp_ave4, temp_ave5], 
-    dim='lon')
-
-# saving afternoon average arrays as pickle files 
-no2_store = {'no2_ave': afternoon_ave_no2}
-file_out = open("/projectnb/atmchem/shared/geocf_usa/geocf_afternoon_ave_no2.pkl", "wb")
-pickle.dump(no2_store, file_out)
-                
-col_store = {'col_ave': afternoon_ave_column}
-file_out = open("/projectnb/atmchem/shared/geocf_usa/geocf_afternoon_ave_column.pkl", "wb")
-pickle.dump(col_store, file_out)
-
-temp_store = {'temp_ave': afternoon_ave_temp}
-file_out = open("/projectnb/atmchem/shared/geocf_usa/geocf_afternoon_ave_temp.pkl", "wb")
-pickle.dump(temp_store, file_out)
\ No newline at end of file
+# function to take afternoon averages straight from the UTC hourly array 
+# local hour and date of each (time, lon) pair come from integer...
+# ...arithmetic on the time axis, only the pairs within the local-hour...
+# ...window are gathered into a (date, hour, lat, lon) array and that...
+# ...array is reduced over hour in one numpy call 
+# how = 'mean', 'max' or 'count' (number of valid hours) 
+# output is an xarray with one value per local date, with no dates if...
+# ...no timestep falls in the window 
+def afternoon_average(array, hours=afternoon_hours, how='mean'): 
+    
+    local = local_hours(array.time.values, array.lon.values)
+    hour = local % 24
+    in_window = (hour >= hours[0]) & (hour <= hours[1])
+    time_index, lon_index = np.nonzero(in_window)
+    day = local[time_index, lon_index] // 24
+    if len(day): 
+        first_day = day.min()
+        n_days = day.max() - first_day + 1
+    else: 
+        # no timestep falls in the window (e.g. a slice at the end of the...
+        # ...record, or UTC hours pulled for another window): no dates 
+        first_day = 0
+        n_days = 0
+    
+    # gathering afternoon values, NaN where an hour is missing 
+    window = np.full((n_days, hours[1] - hours[0] + 1, array.sizes['lat'], 
+                      array.sizes['lon']), np.nan, 
+                     dtype=np.result_type(array.dtype, np.float32))
+    values = array.transpose('time', 'lat', 'lon').values
+    window[day - first_day, hour[time_index, lon_index] - hours[0], :, 
+           lon_index] = values[time_index, :, lon_index]
+    
+    if how == 'mean': 
+        valid = ~np.isnan(window)
+        count = valid.sum(axis=1)
+        total = np.where(valid, window, 0).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'): 
+            afternoon = np.where(count > 0, total / count, np.nan)
+    elif how == 'max': 
+        afternoon = np.fmax.reduce(window, axis=1)
+    elif how == 'count': 
+        afternoon = np.count_nonzero(~np.isnan(window), axis=1)
+    else: 
+        raise ValueError("how must be 'mean', 'max' or 'count'")
+    
+    dates = (first_day + np.arange(n_days)).astype('datetime64[D]')
+    
+    return xr.DataArray(afternoon, 
+                        coords=[("date", dates.astype('datetime64[ns]')), 
+                                ("lat", array.lat.values), 
+                                ("lon", array.lon.values)])
+
+# saving afternoon average arrays as stores (see geoscf_store.py) 
+# the whole record is rewritten, so any older store is removed first 
+def afternoon_store_save(array, variable, store_path): 
+    if os.path.exists(store_path): 
+        os.remove(store_path)
+    gs.store_write(store_path, variable, array.values, array.date.values, 
+                   array.lat.values, array.lon.values, time_dim='date', 
+                   chunk_times=31)
+
+# output stores for the afternoon averages 
+no2_ave_path = str(geoscf_usa_path / 'geocf_afternoon_ave_no2.nc')
+column_ave_path = str(geoscf_usa_path / 'geocf_afternoon_ave_column.nc')
+temp_ave_path = str(geoscf_usa_path / 'geocf_afternoon_ave_temp.nc')
+
+
+############### Streaming Month-by-Month Afternoon Averages ##################
+
+# function to give the first hour and the end hour (exclusive) read for...
+# ...a month, with the hours of the months either side that its local...
+# ...afternoons reach into 
+def month_window(month, lead_hours, halo_hours): 
+    first_hour = month.astype('datetime64[h]') - lead_hours
+    end_hour = (month + 1).astype('datetime64[h]') + halo_hours
+    return first_hour, end_hour
+
+# function to give a signature of the input of each month's averages 
+# made from the timesteps of the store in the month's window and the...
+# ...checksums the pull manifest (see geoscf_data_pull.py) records for...
+# ...the month and the months either side, so a back-filled, merged or...
+# ...re-pulled month changes the signature of every month reading it 
+def month_signatures(store_path, times, months, lead_hours, halo_hours): 
+    
+    # checksums of the months pulled into this store 
+    manifest = gdp.load_manifest(os.path.join(
+        os.path.dirname(os.path.abspath(store_path)), 'geocf_manifest.json'))
+    checksums = {}
+    for entry in manifest.values(): 
+        if os.path.abspath(entry['file']) == os.path.abspath(store_path): 
+            month = np.datetime64(str(entry['year'])+'-'+
+                                  str(entry['month']).zfill(2), 'M')
+            checksums[str(month)] = entry['sha256']
+    
+    seconds = np.asarray(times).astype('datetime64[s]')
+    signatures = {}
+    for month in months: 
+        first_hour, end_hour = month_window(month, lead_hours, halo_hours)
+        in_window = seconds[(seconds >= first_hour) & (seconds < end_hour)]
+        neighbours = [checksums.get(str(month + i)) for i in (-1, 0, 1)]
+        signatures[str(month)] = hashlib.sha256(
+            in_window.astype(np.int64).tobytes() + 
+            json.dumps(neighbours).encode()).hexdigest()[:16]
+    return signatures
+
+# function to read the month signatures recorded in an output store 
+def done_signatures(out_path): 
+    if not os.path.exists(out_path): 
+        return {}
+    with netCDF4.Dataset(out_path, 'r') as nc: 
+        if 'source_months' not in nc.ncattrs(): 
+            return {}
+        return json.loads(nc.getncattr('source_months'))
+
+# function to compute afternoon averages one month at a time 
+# each month is read from the variable store with the hours of the next...
+# ...(and previous) month that its local afternoons reach into, so local...
+# ...days at the month boundaries are complete 
+# each month's daily values are written to the output store before the...
+# ...next month is read, so memory is about one month of one variable 
+# the output store records the signature of the input of each month...
+# ...(see month_signatures), and only months whose input is new or has...
+# ...changed since they were averaged are recomputed, e.g. new months,...
+# ...the growing last month, or an earlier month back-filled or re-pulled 
+def afternoon_stream(store_path, out_path, out_variable, 
+                     hours=afternoon_hours, how='mean'): 
+    
+    store = gs.store_open(store_path)
+    
+    # hours before and after the month needed by the local afternoons 
+    offsets = gdp.utc_offset(store.lon.values)
+    lead_hours = max(0, int(offsets.max()) - hours[0])
+    halo_hours = max(0, hours[1] - int(offsets.min()) - 23)
+    
+    months = np.unique(store.time.values.astype('datetime64[M]'))
+    signatures = month_signatures(store_path, store.time.values, months, 
+                                  lead_hours, halo_hours)
+    done = done_signatures(out_path)
+    months = [x for x in months if done.get(str(x)) != signatures[str(x)]]
+    
+    for month in months: 
+        first_hour, end_hour = month_window(month, lead_hours, halo_hours)
+        array = store.sel(time=slice(first_hour, 
+                                     end_hour - np.timedelta64(1, 's')))
+        
+        month_ave = afternoon_average(array.load(), hours, how)
+        month_ave = month_ave.sel(date=slice(
+            month.astype('datetime64[D]'), 
+            (month + 1).astype('datetime64[D]') - 1))
+        
+        # earlier months are merged in among the later ones 
+        gs.store_write(out_path, out_variable, month_ave.values, 
+                       month_ave.date.values, month_ave.lat.values, 
+                       month_ave.lon.values, time_dim='date', 
+                       chunk_times=31)
+        
+        # recorded after the month is written, so an interrupted run...
+        # ...recomputes it 
+        done[str(month)] = signatures[str(month)]
+        with netCDF4.Dataset(out_path, 'a') as nc: 
+            nc.setncattr('source_months', json.dumps(done, sort_keys=True))
+        print(out_variable, month, len(month_ave.date), 'days')
+    
+    store.close()
+
+
+########################### Running the Processing ###########################
+
+# function to write the afternoon averages of all three variables 
+# streams month by month from the stores, or reads the whole record of...
+# ...the older pickle files (streaming needs a store for every variable) 
+# returns the paths of the output stores 
+def afternoon_run(streaming=streaming): 
+    
+    no2_filelist, column_filelist, temp_filelist = variable_filelists()
+    
+    # streaming needs a store for every variable 
+    streaming = streaming and all(
+        filelist[0].endswith('.nc') for filelist in 
+        [no2_filelist, column_filelist, temp_filelist])
+    
+    if streaming: 
+        afternoon_stream(no2_filelist[0], no2_ave_path, 'no2_ave')
+        afternoon_stream(column_filelist[0], column_ave_path, 'col_ave')
+        afternoon_stream(temp_filelist[0], temp_ave_path, 'temp_ave')
+        return [no2_ave_path, column_ave_path, temp_ave_path]
+    
+    # storing the data 
+    no2_list = data_dictionary_store(no2_filelist)
+    column_list = data_dictionary_store(column_filelist)
+    temp_list = data_dictionary_store(temp_filelist)
+    
+    # latitude and longitude as lists for xarray dimensions, from the...
+    # ...server only if a pickle file does not carry its own 
+    lat_list = lon_list = None
+    if not all('lat' in x for x in no2_list + column_list + temp_list): 
+        lat_array, lon_array = opendap_lat_lon()
+        lat_list = np.ndarray.tolist(lat_array)
+        lon_list = np.ndarray.tolist(lon_array)
+    
+    # converting no2, temp, and column dictionaries to xarrays 
+    no2_array_list = dict_to_array(no2_list, 
+                                   'no2_dat', 'no2_arr', lat_list, lon_list)
+    column_array_list = dict_to_array(column_list, 
+                                      'no2_dat', 'no2_arr', lat_list, 
+                                      lon_list)
+    temp_array_list = dict_to_array(temp_list, 
+                                    't10_dat', 't10_arr', lat_list, lon_list)
+    
+    # concatenating along time axes to obtain a single xarray for each...
+    # ...variable (see time_concat.py) 
+    no2_array = tc.concat_time(no2_array_list, dim='time')
+    column_array = tc.concat_time(column_array_list, dim='time')
+    temp_array = tc.concat_time(temp_array_list, dim='time')
+    
+    # afternoon averages of no2, column no2 and temperature 
+    # values are all based on local time so no timezone split is needed 
+    afternoon_ave_no2 = afternoon_average(no2_array)
+    afternoon_ave_column = afternoon_average(column_array)
+    afternoon_ave_temp = afternoon_average(temp_array)
+    
+    afternoon_store_save(afternoon_ave_no2, 'no2_ave', no2_ave_path)
+    afternoon_store_save(afternoon_ave_column, 'col_ave', column_ave_path)
+    afternoon_store_save(afternoon_ave_temp, 'temp_ave', temp_ave_path)
+    return [no2_ave_path, column_ave_path, temp_ave_path]
+
+
+if __name__ == '__main__': 
+    afternoon_run()
+
@@ -10,9 +10,16 @@ modified from code by jgeddes
 
 import xarray as xr
 import numpy as np
-import pickle
 import datetime
 import calendar
+import time
+import random
+import os
+import json
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import geoscf_store as gs
 
 url_dir = "https://opendap.nccs.nasa.gov/dods/gmao/geos-cf/assim/"
 url_aqc = "aqc_tavg_1hr_g1440x721_v1"
@@ -20,131 +27,388 @@ url_chm = "chm_tavg_1hr_g1440x721_v1"
 url_xgc = "xgc_tavg_1hr_g1440x721_x1"
 url_met = 'met_tavg_1hr_g1440x721_x1'
 
-url = url_dir + url_aqc 
-ds = xr.open_dataset(url)
-
 # Decide on up your lat/lon slice boundaries
 min_lon = -130
 min_lat = 22
 max_lon = -59
 max_lat = 53
- 
+
 # year/months of data 
 years = [2020]
 months = np.array([12])
 
-for y in years:
-    for m in months:
-        d_last = datetime.date(y, m, calendar.monthrange(y, m)[-1]).day
-
-        first_datestring = str(y)+'-'+str(m).zfill(2)+'-'+'01'
-        last_datestring = str(y)+'-'+str(m).zfill(2)+'-'+str(d_last).zfill(2)
-        
-        # Retrieve the output over that area slice for NO2:
-        no2 = ds.no2.sel(lon=slice(min_lon, max_lon), 
-                         lat=slice(min_lat, max_lat), 
-                         time=slice(first_datestring, last_datestring) )
-
-        S = np.shape(no2)
-        NN = S[0]
-        nlat = S[2]
-        nlon = S[3]
-
-        no2_arr = np.zeros((NN, nlat, nlon))
-        no2_dat = np.empty(NN, dtype='datetime64[s]')
-        no2_dat[:] = np.datetime64('1970-01-01T00:30:00')
-
-
-        for i in range(NN):
-            no2_arr[i,:,:] = np.squeeze(no2[i].values)
-            no2_dat[i] = no2[i].time.values
-            print ('no2 aqc', no2_dat[i])
-        
-        no2_store = {'no2_arr':no2_arr, 'no2_dat':no2_dat}
-    
-        file_out = open("/projectnb/atmchem/rhmooers/geoscf/geocf_no2usa_"+str(y)+str(m).zfill(2)+".pkl", "wb")
-        pickle.dump(no2_store, file_out)
-        
-
-url = url_dir + url_xgc 
-ds = xr.open_dataset(url)
-
-
-for y in years:
-    for m in months:
-        d_last = datetime.date(y, m, calendar.monthrange(y, m)[-1]).day
-
-        first_datestring = str(y)+'-'+str(m).zfill(2)+'-'+'01'
-        last_datestring = str(y)+'-'+str(m).zfill(2)+'-'+str(d_last).zfill(2)
-        
-        # Retrieve the output over that area slice for NO2:
-        no2 = ds.tropcol_no2.sel(lon=slice(min_lon, max_lon), 
-                                 lat=slice(min_lat, max_lat), 
-                                 time=slice(first_datestring, last_datestring) )
-
-        S = np.shape(no2)
-        NN = S[0]
-        nlat = S[1]
-        nlon = S[2]
-
-        no2_arr = np.zeros((NN, nlat, nlon))
-        no2_dat = np.empty(NN, dtype='datetime64[s]')
-        no2_dat[:] = np.datetime64('1970-01-01T00:30:00')
-
-
-        for i in range(NN):
-            no2_arr[i,:,:] = np.squeeze(no2[i].values)
-            no2_dat[i] = no2[i].time.values
-            print ('no2 aqc', no2_dat[i])
-        
-        no2_store = {'no2_arr':no2_arr, 'no2_dat':no2_dat}
-    
-        file_out = open("/projectnb/atmchem/rhmooers/geoscf/geocf_trpcolusa_"+str(y)+str(m).zfill(2)+".pkl", "wb")
-        pickle.dump(no2_store, file_out)
-
-
-url = url_dir + url_met 
-ds = xr.open_dataset(url)
-
-
-for y in years:
-    for m in months:
-        d_last = datetime.date(y, m, calendar.monthrange(y, m)[-1]).day
-
-        first_datestring = str(y)+'-'+str(m).zfill(2)+'-'+'01'
-        last_datestring = str(y)+'-'+str(m).zfill(2)+'-'+str(d_last).zfill(2)
-        
-        # Retrieve the output over that area slice for NO2:
-        t10 = ds.t10m.sel(lon=slice(min_lon, max_lon), 
-                          lat=slice(min_lat, max_lat), 
-                          time=slice(first_datestring, last_datestring) )
-
-        S = np.shape(t10)
-        NN = S[0]
-        nlat = S[1]
-        nlon = S[2]
-
-        t10_arr = np.zeros((NN, nlat, nlon))
-        t10_dat = np.empty(NN, dtype='datetime64[s]')
-        t10_dat[:] = np.datetime64('1970-01-01T00:30:00')
-
-
-        for i in range(NN):
-            t10_arr[i,:,:] = np.squeeze(t10[i].values)
-            t10_dat[i] = t10[i].time.values
-            print ('no2 aqc', t10_dat[i])
-        
-        t10_store = {'t10_arr':t10_arr, 't10_dat':t10_dat}
-    
-        file_out = open("/projectnb/atmchem/rhmooers/geoscf/geocf_t10usa_"+str(y)+str(m).zfill(2)+".pkl", "wb")
-        pickle.dump(t10_store, file_out)
-    
-
-# Example code to open the pickle files:
-example_filename='"/projectnb/atmchem/rhmooers/geoscf/geocf_trpcolusa_201905.pkl'
-no2_dict = pickle.load(open(example_filename, "rb"))
-
-# Check contents of dictionary
-print(no2_dict.keys())
-print('no2_arr shape', np.shape(no2_dict['no2_arr']))
-print('no2_dat (datetime) shape', np.shape(no2_dict['no2_dat']))
\ No newline at end of file
+# number of hourly timesteps fetched per OPeNDAP request 
+# e.g. 24 = one day, 168 = one week, 1 = one request per hour 
+block_hours = 24
+
+# local-time window (first hour, last hour) to pull, e.g. (12, 15) for...
+# ...the afternoon averages, or None to pull all 24 hours of each day
+# only the UTC hours covering this window across min_lon to max_lon...
+# ...are requested from the server
+local_hours = None
+
+# number of (collection, year, month) tasks downloading at once
+n_workers = 4
+
+# retries and initial wait (seconds) when the server throttles a request
+# the wait doubles after every failed attempt
+max_retries = 6
+backoff_seconds = 5
+
+# output directory for the variable stores (see geoscf_store.py)
+# the afternoon averages are read from and written to this directory...
+# ...too (see geoscf_afternoon_averages.py)
+out_dir = "/projectnb/atmchem/shared/geocf_usa/"
+
+# store values as float32 (the precision served by GEOS-CF) or float64
+store_float32 = True
+
+# variables to pull: collection, variable name, file tag
+collections = [(url_aqc, 'no2', 'no2usa'),
+               (url_xgc, 'tropcol_no2', 'trpcolusa'),
+               (url_met, 't10m', 't10usa')]
+
+
+# open OPeNDAP datasets, one per collection in each worker process
+open_datasets = {}
+
+# function to open a collection once and reuse the handle for every task
+def open_collection(collection):
+    if collection not in open_datasets:
+        open_datasets[collection] = xr.open_dataset(url_dir + collection)
+    return open_datasets[collection]
+
+
+# function to run one OPeNDAP request, backing off when the server throttles
+# failed requests are retried after an exponentially growing, jittered wait
+def fetch_with_backoff(request, label):
+    wait = backoff_seconds
+    for attempt in range(max_retries + 1):
+        try:
+            return request()
+        except (OSError, RuntimeError) as error:
+            if attempt == max_retries:
+                raise
+            print(label, 'request failed (', error, '), retrying in',
+                  round(wait, 1), 's')
+            time.sleep(wait * random.uniform(0.5, 1.5))
+            wait = wait * 2
+
+
+############################ Hour-of-Day Subsets #############################
+
+# Convention for time adjustments, also used for the afternoon averages...
+# ...(see geoscf_afternoon_averages.py):
+# -60 +- 7.5 degrees (52.5-67.5) = UTC - 4
+# -75 +- 7.5 degrees (67.5-82.5) = UTC - 5
+# -90 +- 7.5 degrees (82.5-97.5) = UTC - 6
+# -105 +- 7.5 degrees (97.5-112.5) = UTC - 7
+# -120 +- 7.5 degrees (112.5-127.5) = UTC - 8
+# boundary longitudes (e.g. -112.5) belong to the zone to their west
+# and the same 15 degree zones continue past -127.5 and -52.5
+
+# function to give the UTC offset (hours) of each longitude
+def utc_offset(lon):
+    return np.ceil((np.asarray(lon) + 7.5) / 15).astype(int) - 1
+
+# function to list the UTC hours needed for a local-time window...
+# ...anywhere between the two longitudes
+def utc_hours_needed(local_hours, min_lon, max_lon):
+    offsets = range(int(utc_offset(min_lon)), int(utc_offset(max_lon)) + 1)
+    hours = set()
+    for offset in offsets:
+        for hour in range(local_hours[0], local_hours[1] + 1):
+            hours.add((hour - offset) % 24)
+    return sorted(hours)
+
+# function to group time indices into strided requests
+# each request is an evenly spaced run of at most block_hours indices...
+# ...so that one hour of every day is a single strided OPeNDAP request
+# returns (first position, last position + 1, slice) for each request
+def strided_requests(indices, block_hours):
+    requests = []
+    i = 0
+    while i < len(indices):
+        j = i + 1
+        if j < len(indices):
+            step = indices[j] - indices[i]
+            while (j < len(indices) and j - i < block_hours
+                   and indices[j] - indices[j-1] == step):
+                j += 1
+        else:
+            step = 1
+        requests.append((i, j, slice(indices[i], indices[j-1] + 1, step)))
+        i = j
+    return requests
+
+
+# function to retrieve a month of data in blocks of timesteps 
+# the full time coordinate is fetched in a single call and each block...
+# ...of block_hours timesteps is a single OPeNDAP request 
+# with utc_hours given only those hours of each day are requested...
+# ...one strided request per hour of day and block
+# prints the achieved throughput in MB/s for tuning block_hours 
+def block_retrieve(data_array, block_hours, label, utc_hours=None):
+
+    # time coordinate for the whole month in one request 
+    dat = fetch_with_backoff(
+        lambda: data_array.time.values.astype('datetime64[s]'), label)
+
+    # timesteps to retrieve, grouped into requests of...
+    # ...(rows of the output array, time slice on the server)
+    if utc_hours is None:
+        requests = [(slice(i, j), slice(i, j)) for i, j, time_slice 
+                    in strided_requests(np.arange(len(dat)), block_hours)]
+    else:
+        hours = dat.astype('datetime64[h]').astype(int) % 24
+        indices = np.nonzero(np.isin(hours, utc_hours))[0]
+        requests = []
+        for hour in utc_hours:
+            hour_indices = indices[hours[indices] == hour]
+            rows = np.searchsorted(indices, hour_indices)
+            for i, j, time_slice in strided_requests(hour_indices, 
+                                                     block_hours):
+                requests.append((rows[i:j], time_slice))
+        dat = dat[indices]
+
+    NN = len(dat)
+    nlat = data_array.sizes['lat']
+    nlon = data_array.sizes['lon']
+
+    arr = np.zeros((NN, nlat, nlon))
+
+    n_bytes = 0
+    start = time.perf_counter()
+    for rows, time_slice in requests:
+        block = fetch_with_backoff(
+            lambda: data_array.isel(time=time_slice).values, label)
+        # dropping the single vertical level of the aqc collection 
+        arr[rows,:,:] = np.reshape(block, (-1, nlat, nlon))
+        n_bytes += block.nbytes
+        print(label, dat[rows][0], 'to', dat[rows][-1])
+    elapsed = time.perf_counter() - start
+
+    mb = n_bytes / 1e6
+    print(label, NN, 'timesteps,', round(mb, 1), 'MB in', 
+          round(elapsed, 1), 's,', round(mb / max(elapsed, 1e-9), 2), 
+          'MB/s')
+
+    return arr, dat
+
+
+# function to build the path of the store for a variable
+def store_filename(tag):
+    return out_dir+"geocf_"+tag+".nc"
+
+# function to build the first and last date strings of a month
+def month_datestrings(y, m):
+    d_last = datetime.date(y, m, calendar.monthrange(y, m)[-1]).day
+    first_datestring = str(y)+'-'+str(m).zfill(2)+'-'+'01'
+    last_datestring = str(y)+'-'+str(m).zfill(2)+'-'+str(d_last).zfill(2)
+    return first_datestring, last_datestring, d_last
+
+
+############################# Download Manifest ##############################
+
+# the manifest records every (variable, month) chunk that has been written...
+# ...with its time range, size and sha256 checksum of the stored values
+# re-runs only fetch chunks that are missing, partial or fail verification
+
+# re-read and checksum stored months on re-runs, not just count timesteps
+verify_checksums = True
+
+# function to read the manifest, empty if nothing has been pulled yet
+def load_manifest(manifest_file):
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as file_in:
+        return json.load(file_in)
+
+# function to write the manifest
+# written to a temporary file first so a crash cannot leave it half-written
+def save_manifest(manifest, manifest_file):
+    with open(manifest_file+'.tmp', 'w') as file_out:
+        json.dump(manifest, file_out, indent=1, sort_keys=True)
+    os.replace(manifest_file+'.tmp', manifest_file)
+
+# function to read a month back from a store
+# returns the stored times and the sha256 checksum of the stored values
+def chunk_checksum(store_path, variable, first_datestring, last_datestring):
+    store = gs.store_open(store_path, variable)
+    chunk = store.sel(time=slice(first_datestring, last_datestring))
+    values = np.ascontiguousarray(chunk.values)
+    data_dat = chunk.time.values.astype('datetime64[s]')
+    store.close()
+    return (data_dat, hashlib.sha256(values.tobytes()).hexdigest(),
+            values.nbytes)
+
+# function to build the manifest entry of a month from its store
+def month_entry(variable, tag, y, m, utc_hours):
+    store_path = store_filename(tag)
+    first_datestring, last_datestring, d_last = month_datestrings(y, m)
+    data_dat, sha256, n_bytes = chunk_checksum(
+        store_path, variable, first_datestring, last_datestring)
+    hours_per_day = 24 if utc_hours is None else len(utc_hours)
+    return {'variable': variable, 'tag': tag, 'year': y, 'month': m,
+            'file': store_path,
+            'first_time': str(data_dat[0]) if len(data_dat) else None,
+            'last_time': str(data_dat[-1]) if len(data_dat) else None,
+            'n_times': len(data_dat),
+            'utc_hours': utc_hours,
+            'complete': len(data_dat) == hours_per_day * d_last,
+            'bytes': n_bytes,
+            'sha256': sha256}
+
+# function to check a manifest entry against the store on disk
+# returns 'complete', 'partial' (month not yet fully available) or 'missing'
+# a complete month holding all of the requested UTC hours is reused, while...
+# ...a partial month is only resumed with the same hours
+def chunk_status(entry, utc_hours=None):
+    if entry is None or entry['n_times'] == 0:
+        return 'missing'
+    entry_hours = set(entry.get('utc_hours') or range(24))
+    requested_hours = set(utc_hours or range(24))
+    if not requested_hours <= entry_hours:
+        return 'missing'
+    if not entry['complete'] and requested_hours != entry_hours:
+        return 'missing'
+    if not os.path.exists(entry['file']):
+        return 'missing'
+    if verify_checksums:
+        data_dat, sha256, n_bytes = chunk_checksum(
+            entry['file'], entry['variable'], entry['first_time'],
+            entry['last_time'])
+        if sha256 != entry['sha256'] or n_bytes != entry['bytes']:
+            return 'missing'
+    else:
+        store_dat = gs.store_times(entry['file'])
+        in_month = ((store_dat >= np.datetime64(entry['first_time']))
+                    & (store_dat <= np.datetime64(entry['last_time'])))
+        if np.count_nonzero(in_month) != entry['n_times']:
+            return 'missing'
+    if entry['complete']:
+        return 'complete'
+    return 'partial'
+
+
+# function to pull one month of one variable
+# a partial manifest entry means only the timesteps after its last time...
+# ...are fetched, to be appended to the store
+# returns the bytes retrieved, the time taken and the data to store
+def pull_month(collection, variable, tag, y, m, entry=None, utc_hours=None):
+
+    ds = open_collection(collection)
+
+    first_datestring, last_datestring, d_last = month_datestrings(y, m)
+
+    # only the missing end of a partially pulled month
+    if entry is not None:
+        first_datestring = str(np.datetime64(entry['last_time'])
+                               + np.timedelta64(1, 'h'))
+
+    # Retrieve the output over that area slice for the variable:
+    data = ds[variable].sel(lon=slice(min_lon, max_lon),
+                            lat=slice(min_lat, max_lat),
+                            time=slice(first_datestring, last_datestring))
+
+    label = variable+' '+str(y)+str(m).zfill(2)
+    start = time.perf_counter()
+    data_arr, data_dat = block_retrieve(data, block_hours, label, 
+                                        utc_hours)
+    elapsed = time.perf_counter() - start
+    n_bytes = data_arr.size * data.dtype.itemsize
+
+    if store_float32:
+        data_arr = data_arr.astype(np.float32)
+
+    return (label, n_bytes, elapsed, data_arr, data_dat,
+            data.lat.values, data.lon.values)
+
+
+# function to run (collection, year, month) tasks concurrently
+# a bounded pool of worker processes keeps n_workers requests in flight...
+# ...so the network is not idle while earlier responses are written out
+# months are appended to the stores in date order by this process only...
+# ...with at most 2 x n_workers finished months waiting in memory
+# chunks already complete in the manifest are skipped
+def pull_schedule(collections, years, months, n_workers):
+
+    manifest_file = out_dir + "geocf_manifest.json"
+    manifest = load_manifest(manifest_file)
+
+    # UTC hours covering the local-time window, None for all hours
+    utc_hours = None
+    if local_hours is not None:
+        utc_hours = utc_hours_needed(local_hours, min_lon, max_lon)
+        print('pulling UTC hours', utc_hours)
+
+    tasks = []
+    for y in years:
+        for m in months:
+            for collection in collections:
+                tag = collection[2]
+                key = tag+'_'+str(y)+str(m).zfill(2)
+                entry = manifest.get(key)
+                status = chunk_status(entry, utc_hours)
+                if status == 'complete':
+                    print('skipping', key, '(complete)')
+                    continue
+                if status == 'missing':
+                    entry = None
+                tasks.append(collection + (int(y), int(m), entry, 
+                                           utc_hours))
+
+    start = time.perf_counter()
+    total_bytes = 0
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append((task, executor.submit(pull_month, *task)))
+            if len(pending) == 2 * n_workers:
+                total_bytes += store_month(manifest, manifest_file,
+                                           *pending.popleft())
+        while pending:
+            total_bytes += store_month(manifest, manifest_file,
+                                       *pending.popleft())
+    elapsed = time.perf_counter() - start
+
+    mb = total_bytes / 1e6
+    print(len(tasks), 'tasks,', round(mb, 1), 'MB in', round(elapsed, 1),
+          's with', n_workers, 'workers,',
+          round(mb / max(elapsed, 1e-9), 2), 'MB/s')
+
+
+# function to append a finished month to its store and record it
+# the manifest is updated as soon as each month is written
+def store_month(manifest, manifest_file, task, future):
+    collection, variable, tag, y, m = task[:5]
+    utc_hours = task[6]
+    (label, n_bytes, elapsed, data_arr, data_dat, 
+     lat, lon) = future.result()
+
+    if len(data_dat):
+        gs.store_write(store_filename(tag), variable, data_arr, data_dat,
+                       lat, lon, float32=store_float32)
+
+    manifest[tag+'_'+str(y)+str(m).zfill(2)] = month_entry(
+        variable, tag, y, m, utc_hours)
+    save_manifest(manifest, manifest_file)
+    print('finished', label, 'in', round(elapsed, 1), 's')
+
+    return n_bytes
+
+
+if __name__ == '__main__':
+    pull_schedule(collections, years, months, n_workers)
+
+
+# Example code to open the stores:
+'''
+example_filename = "/projectnb/atmchem/rhmooers/geoscf/geocf_trpcolusa.nc"
+no2 = gs.store_read(example_filename, time=slice('2019-05-01', '2019-05-31'))
+
+# Check contents of the store
+print(no2)
+print('no2 shape', np.shape(no2))
+print('no2 time shape', np.shape(no2.time))
+'''
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:41:07 2026
+
+@author: rhmooers
+"""
+
+##### Chunked, Compressed NetCDF4 Stores for GEOS-CF Data #####
+
+# one store (.nc file) per variable with time (or date), lat and lon axes
+# replaces the monthly pickle files, so downstream code can read...
+# ...a slice of the record without loading whole months into memory
+# the time axis is unlimited so new months are appended without...
+# ...rewriting the months already in the store
+
+import numpy as np
+import xarray as xr
+import netCDF4
+import os
+
+
+# keys used by the old monthly pickle files for each variable
+pickle_keys = {'no2': ('no2_arr', 'no2_dat'),
+               'tropcol_no2': ('no2_arr', 'no2_dat'),
+               't10m': ('t10_arr', 't10_dat')}
+
+# time units stored in the files (decoded to datetime64 by xarray)
+time_units = 'seconds since 1970-01-01 00:00:00'
+
+
+# function to write (time, lat, lon) data into a store
+# creates the store (or its axes and the variable in an existing file)...
+# ...on first use
+# afterwards timesteps later than the end of the store are appended and...
+# ...timesteps already in the store are overwritten in place...
+# ...(e.g. a re-pulled month)
+# timesteps falling between those of the store (e.g. a month re-pulled...
+# ...with all 24 hours after pulling only some hours of each day) are...
+# ...merged in by store_merge
+# float32 halves the storage of the float64 arrays used in processing
+# chunk_times is the number of timesteps per compressed chunk
+def store_write(store_path, variable, data_arr, times, lat, lon,
+                time_dim='time', float32=False, chunk_times=24,
+                complevel=4):
+
+    seconds = np.asarray(times).astype('datetime64[s]').astype(np.int64)
+    data_arr = np.reshape(data_arr, (len(seconds), len(lat), len(lon)))
+
+    if not os.path.exists(store_path):
+        netCDF4.Dataset(store_path, 'w').close()
+
+    with netCDF4.Dataset(store_path, 'a') as nc:
+
+        # the axes are made by the first write (the file may already...
+        # ...exist, e.g. holding only attributes)
+        if time_dim not in nc.dimensions:
+            nc.createDimension(time_dim, None)
+            nc.createDimension('lat', len(lat))
+            nc.createDimension('lon', len(lon))
+
+            time_var = nc.createVariable(time_dim, 'i8', (time_dim,))
+            time_var.units = time_units
+            time_var.calendar = 'standard'
+            nc.createVariable('lat', 'f8', ('lat',))[:] = lat
+            nc.createVariable('lon', 'f8', ('lon',))[:] = lon
+
+        if (not np.allclose(nc['lat'][:], lat)
+                or not np.allclose(nc['lon'][:], lon)):
+            raise ValueError(store_path+' has a different lat/lon grid')
+
+        # a store may hold several variables sharing its time axis
+        if variable not in nc.variables:
+            # chunks span a block of timesteps and a spatial tile...
+            # ...so time and space windows only decompress what they need
+            nc.createVariable(variable, 'f4' if float32 else 'f8',
+                              (time_dim, 'lat', 'lon'), zlib=True,
+                              complevel=complevel, shuffle=True,
+                              chunksizes=(chunk_times,
+                                          min(len(lat), 128),
+                                          min(len(lon), 128)),
+                              fill_value=np.nan)
+
+        # rows of the store from the first to the last new timestep
+        store_seconds = np.asarray(nc[time_dim][:], dtype=np.int64)
+        if not len(seconds):
+            return
+        start = np.searchsorted(store_seconds, seconds[0])
+        stop = np.searchsorted(store_seconds, seconds[-1], side='right')
+        overlap = store_seconds[start:stop]
+
+        # appending, or overwriting the same timesteps, is done in place
+        if np.array_equal(overlap, seconds[:len(overlap)]) and (
+                stop == len(store_seconds) or len(overlap) == len(seconds)):
+            nc[time_dim][start:start+len(seconds)] = seconds
+            nc[variable][start:start+len(seconds),:,:] = data_arr
+        else:
+            store_merge(nc, variable, time_dim, start, stop, seconds,
+                        data_arr, chunk_times)
+
+
+# function to merge timesteps into rows start:stop of an open store
+# the rows after stop are moved back to make room, a block of timesteps...
+# ...at a time starting from the end, for every variable on the time...
+# ...axis so the variables of a store stay aligned
+# in the merged rows the values of the store are kept at their...
+# ...timesteps, the new values of variable replace them at the new...
+# ...timesteps, and other variables are NaN at timesteps new to the store
+def store_merge(nc, variable, time_dim, start, stop, seconds, data_arr,
+                block):
+    store_seconds = np.asarray(nc[time_dim][:], dtype=np.int64)
+    n_times = len(store_seconds)
+    merged = np.union1d(store_seconds[start:stop], seconds)
+    shift = len(merged) - (stop - start)
+    names = [name for name, var in nc.variables.items()
+             if var.dimensions[:1] == (time_dim,)]
+
+    # reading the merged rows before anything is moved
+    old_rows = np.searchsorted(merged, store_seconds[start:stop])
+    new_rows = np.searchsorted(merged, seconds)
+    regions = {}
+    for name in names:
+        if name == time_dim:
+            continue
+        old_values = np.ma.filled(nc[name][start:stop], np.nan)
+        regions[name] = np.full((len(merged),) + old_values.shape[1:],
+                                np.nan)
+        regions[name][old_rows] = old_values
+    regions[variable][new_rows] = data_arr
+
+    for end in range(n_times, stop, -block):
+        begin = max(stop, end - block)
+        for name in names:
+            nc[name][begin+shift:end+shift] = nc[name][begin:end]
+
+    nc[time_dim][start:start+len(merged)] = merged
+    for name, region in regions.items():
+        nc[name][start:start+len(merged)] = region
+
+
+# function to open a store for reading
+# nothing is loaded until the values are used, so selecting a time or...
+# ...lat/lon window with .sel() only reads that part of the file
+# .close() on the returned array closes the file
+# chunks (e.g. {'date': 31}) returns a lazily evaluated dask array instead
+def store_open(store_path, variable=None, chunks=None):
+    ds = xr.open_dataset(store_path, engine='netcdf4', chunks=chunks)
+    if variable is None:
+        variable = list(ds.data_vars)[0]
+    array = ds[variable]
+    array.set_close(ds.close)
+    return array
+
+
+# function to read a time and/or space window from a store
+# time, lat and lon are slices (e.g. slice('2020-01-01', '2020-01-31'))
+def store_read(store_path, variable=None, time=None, lat=None, lon=None):
+    array = store_open(store_path, variable)
+    window = {}
+    if time is not None:
+        window[array.dims[0]] = time
+    if lat is not None:
+        window['lat'] = lat
+    if lon is not None:
+        window['lon'] = lon
+    return array.sel(window)
+
+
+# function to list the timesteps already in a store
+def store_times(store_path, time_dim='time'):
+    if not os.path.exists(store_path):
+        return np.array([], dtype='datetime64[s]')
+    with netCDF4.Dataset(store_path, 'r') as nc:
+        seconds = nc[time_dim][:]
+    return np.asarray(seconds, dtype=np.int64).astype('datetime64[s]')
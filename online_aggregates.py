@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:14:37 2026
+
+@author: rhmooers
+"""
+
+##### Persisted Monthly Running Statistics of the Daily Record #####
+
+# the monthly partials of temporal_aggregation.py (sums, valid-day counts,...
+# ...sums of squares and cross-products per pixel per month) are kept in...
+# ...a store (see geoscf_store.py) with one variable per partial
+# when days are added to the daily record only the new days are reduced...
+# ...and their partials added to the store: a month that was incomplete...
+# ...at the last update is added to, later months are appended
+# monthly and yearly means, variances and covariances are then read...
+# ...from the store (see Partial_Moments) without the daily data
+# the store also records a checksum of each month of the days it holds,...
+# ...so a change to a day already added (e.g. a late TROPOMI file) is...
+# ...found (see Changed_Months) instead of leaving the partials stale
+
+import numpy as np
+import xarray as xr
+import netCDF4
+import hashlib
+import json
+import os
+import geoscf_store as gs
+import temporal_aggregation as agg
+
+
+# function to read the last date added to the store (None if no store)
+# a store whose last update was interrupted cannot be added to, as some...
+# ...of its partials include days the others do not
+def Aggregates_Last_Date(store_path):
+    if not os.path.exists(store_path):
+        return None
+    with netCDF4.Dataset(store_path, 'r') as nc:
+        if 'updating' in nc.ncattrs():
+            raise ValueError('the update of '+store_path+' to '+
+                             nc.getncattr('updating')+' was interrupted, '+
+                             'remove the store to rebuild it')
+        return np.datetime64(nc.getncattr('last_date'), 's')
+
+
+# function to give a sha256 checksum of each month of a daily Dataset,...
+# ...from the dates and values of every variable up to and including...
+# ...last_date, read one month at a time
+# from_date gives only the months from the month of from_date on
+def Month_Checksums(daily, last_date, from_date=None):
+    dates = daily.date.values.astype('datetime64[s]')
+    months = dates[:np.searchsorted(dates, last_date, side='right')].astype(
+        'datetime64[M]')
+    checksums = {}
+    for month in np.unique(months):
+        if from_date is not None and month < np.datetime64(from_date, 'M'):
+            continue
+        rows = np.nonzero(months == month)[0]
+        block = daily.isel(date=slice(rows[0], rows[-1]+1)).load()
+        digest = hashlib.sha256(dates[rows].astype(np.int64).tobytes())
+        for name in sorted(block.data_vars):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(block[name].values).tobytes())
+        checksums[str(month)] = digest.hexdigest()[:16]
+    return checksums
+
+
+# function to list the months whose days in the store differ from those...
+# ...of a daily Dataset, up to the last update of the store
+# a store written before checksums were recorded gives all of its months
+# reads every day up to the last update, as their values are compared
+def Changed_Months(store_path, daily):
+    last_date = Aggregates_Last_Date(store_path)
+    if last_date is None:
+        return []
+    with netCDF4.Dataset(store_path, 'r') as nc:
+        recorded = None
+        if 'month_checksums' in nc.ncattrs():
+            recorded = json.loads(nc.getncattr('month_checksums'))
+    current = Month_Checksums(daily, last_date)
+    if recorded is None:
+        return sorted(current)
+    return sorted(x for x in set(recorded) | set(current)
+                  if recorded.get(x) != current.get(x))
+
+
+# function to add the days of a daily Dataset (date, lat, lon) that are...
+# ...later than the last update to the store
+# squares and products are passed on to Monthly_Partials, and must be...
+# ...the same on every update of a store
+# days already in the store are not reduced again, so the cost of an...
+# ...update mostly depends on the number of new days
+# with verify, days already in the store that have changed since they...
+# ...were added raise an error (see Changed_Months), as their partials...
+# ...cannot be taken back out of the store
+# returns the number of days added
+def Aggregates_Update(store_path, daily, squares=True, products=(),
+                      verify=True):
+
+    if verify:
+        changed = Changed_Months(store_path, daily)
+        if changed:
+            raise ValueError('the days of '+', '.join(changed)+' in '+
+                             store_path+' have changed since they were '+
+                             'added, remove the store to rebuild it')
+
+    last_date = Aggregates_Last_Date(store_path)
+    dates = daily.date.values.astype('datetime64[s]')
+    first = 0 if last_date is None else np.searchsorted(dates, last_date,
+                                                        side='right')
+    if first == len(dates):
+        return 0
+
+    partials = agg.Monthly_Partials(daily.isel(date=slice(first, None)),
+                                    squares=squares, products=products)
+
+    # adding the partials of the month that was incomplete at the last...
+    # ...update (the last month in the store)
+    month_dates = partials.date.values
+    store_dates = gs.store_times(store_path, 'date')
+    if len(store_dates) and store_dates[-1] == month_dates[0]:
+        stored = xr.open_dataset(store_path, engine='netcdf4')
+        last_month = stored.isel(date=-1).load()
+        stored.close()
+        for name in partials.data_vars:
+            partials[name][0] += last_month[name].values.astype(
+                partials[name].dtype)
+
+    # flagged before the first write, including when the store is new
+    with netCDF4.Dataset(store_path, 'a' if os.path.exists(store_path)
+                         else 'w') as nc:
+        nc.setncattr('updating', str(dates[-1]))
+
+    for name, values in partials.data_vars.items():
+        # counts are whole numbers, held exactly in float32
+        gs.store_write(store_path, name, values.values, month_dates,
+                       partials.lat.values, partials.lon.values,
+                       time_dim='date', float32=name.endswith('_count'),
+                       chunk_times=12)
+
+    with netCDF4.Dataset(store_path, 'a') as nc:
+        checksums = {}
+        if 'month_checksums' in nc.ncattrs():
+            checksums = json.loads(nc.getncattr('month_checksums'))
+        checksums.update(Month_Checksums(daily, dates[-1], dates[first]))
+        nc.setncattr('month_checksums', json.dumps(checksums,
+                                                   sort_keys=True))
+        nc.setncattr('last_date', str(dates[-1]))
+        if 'updating' in nc.ncattrs():
+            nc.delncattr('updating')
+
+    return len(dates) - first
+
+
+# function to read the monthly partials from the store
+# the result can be passed to the functions of temporal_aggregation.py...
+# ...(e.g. Monthly_Means, Yearly_Partials, Partial_Moments, Count_Means)
+def Aggregates_Read(store_path):
+    with xr.open_dataset(store_path, engine='netcdf4') as stored:
+        partials = stored.load()
+    for name in partials.data_vars:
+        if name.endswith('_count'):
+            partials[name] = partials[name].astype(np.int32)
+    return partials
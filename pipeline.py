@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:24:16 2026
+
+@author: rhmooers
+"""
+
+##### Staged Pipeline from the GEOS-CF Pull to the Figures #####
+
+# runs the workflow as five stages, in order:
+#   pull        hourly GEOS-CF from OPeNDAP into the variable stores...
+#               ...(geoscf_data_pull.py)
+#   afternoon   daily afternoon averages (geoscf_afternoon_averages.py)
+#   align       aligned, cloud-masked GEOS-CF and TROPOMI arrays...
+#               ...(aligned_cache.py)
+#   aggregates  monthly partials and count index of days with data...
+#               ...(online_aggregates.py, valid_days_index.py)
+#   figures     maps rendered to files (batch_rendering.py)
+# each stage declares its input files, its parameters and its output...
+# ...files, and is only run when an output is missing or the inputs or...
+# ...parameters differ from its last run (recorded in state_file)
+# inputs are compared by modification time and size, as in aligned_cache.py
+# the pull, afternoon and align stages share one data directory...
+# ...(gdp.out_dir), so the stores written by the pull are the inputs...
+# ...of the afternoon stage
+# a stage that rewrites its outputs changes the inputs of the next stage...
+# ...so the stages after it are rerun, and the stages before it are not
+# rerun stages only redo what changed: the afternoon stage averages the...
+# ...months whose input changed (see afternoon_stream), and the...
+# ...aggregates stage adds the new days, or rebuilds its stores from the...
+# ...whole record when days it already holds have changed (see...
+# ...temporal_averaging.Aggregates_Update)
+# the time taken by each stage is printed at the end
+# run as a script to run every stage that is out of date, stage names...
+# ...given as arguments are run even if up to date, e.g.
+#   python pipeline.py figures
+
+import os
+import sys
+import json
+import time
+import aligned_cache as cache
+import geoscf_data_pull as gdp
+import geoscf_afternoon_averages as gaa
+import online_aggregates as oa
+import temporal_averaging as ta
+
+
+# record of the inputs and outputs of the last run of each stage
+state_file = os.path.join(cache.read_cache_path, 'pipeline_state.json')
+
+
+# function to list the files of input and output paths, a directory...
+# ...being all of the files inside it
+def Path_Files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, names, filenames in sorted(os.walk(path)):
+                names.sort()
+                files += [os.path.join(directory, x)
+                          for x in sorted(filenames)]
+        else:
+            files.append(path)
+    return files
+
+
+# function to give the fingerprint of a stage's inputs and parameters
+# missing inputs are recorded as missing, so their appearing reruns...
+# ...the stage
+def Fingerprint(inputs, params):
+    files = []
+    for path in Path_Files(inputs):
+        if os.path.exists(path):
+            file_stat = os.stat(path)
+            files.append([os.path.abspath(path), file_stat.st_mtime_ns,
+                          file_stat.st_size])
+        else:
+            files.append([os.path.abspath(path), None, None])
+    return cache.Hash([files, params])
+
+
+# function to read the recorded state, empty if no stage has run
+def Load_State(path=state_file):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file_in:
+        return json.load(file_in)
+
+
+# function to write the recorded state
+# written to a temporary file first so a crash cannot leave it half-written
+def Save_State(state, path=state_file):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path+'.tmp', 'w') as file_out:
+        json.dump(state, file_out, indent=1, sort_keys=True)
+    os.replace(path+'.tmp', path)
+
+
+############################### Stages #######################################
+
+# each stage is a dict of:
+#   name      name of the stage
+#   inputs    function giving the paths read by the stage (files or...
+#             ...directories), called just before the stage so it sees...
+#             ...the outputs of the stages before it
+#   params    parameters that change the outputs (json-serialisable)
+#   outputs   function giving the paths written by the stage
+#   run       function running the stage, returning any other paths...
+#             ...it wrote (e.g. figure files) or None
+#   complete  optional function, False when the stage must run whatever...
+#             ...its inputs (e.g. months not yet fully pulled)
+
+# the pull has no input files, it is out of date when its parameters...
+# ...change or a requested month is not complete in the manifest...
+# ...(the manifest then skips the months already pulled)
+def Pull_Complete():
+    manifest = gdp.load_manifest(gdp.out_dir+"geocf_manifest.json")
+    for y in gdp.years:
+        for m in gdp.months:
+            for collection in gdp.collections:
+                entry = manifest.get(collection[2]+'_'+str(y)+
+                                     str(m).zfill(2))
+                if entry is None or not entry['complete']:
+                    return False
+    return True
+
+def Pull_Outputs():
+    return ([gdp.out_dir+"geocf_manifest.json"] +
+            [gdp.store_filename(collection[2])
+             for collection in gdp.collections])
+
+def Pull_Run():
+    gdp.pull_schedule(gdp.collections, gdp.years, gdp.months, gdp.n_workers)
+
+
+# the variable stores written by the pull (in gdp.out_dir, the...
+# ...directory searched by gaa.variable_filelists)
+def Afternoon_Inputs():
+    no2_filelist, column_filelist, temp_filelist = gaa.variable_filelists()
+    return no2_filelist + column_filelist + temp_filelist
+
+def Afternoon_Outputs():
+    return [gaa.no2_ave_path, gaa.column_ave_path, gaa.temp_ave_path]
+
+
+# the output of align is the cache entry of the current inputs, which...
+# ...does not exist when any input has changed
+def Align_Outputs():
+    inputs_path, key = cache.Read_Cache_Key(ta.geoscf_path, ta.tropomi_path,
+                                            cache.read_cache_path)
+    return [os.path.join(inputs_path, key)]
+
+def Align_Run():
+    ta.Aligned_Read()
+
+
+def Aggregates_Run():
+    (tropomi_col_no2, geoscf_col_no2, geoscf_surf_no2, geoscf_temp,
+     geoscf_col_no2_masked, geoscf_surf_no2_masked,
+     geoscf_temp_masked) = ta.Aligned_Read()
+    ta.Aggregates_Update(tropomi_col_no2, geoscf_col_no2_masked,
+                         geoscf_surf_no2_masked, geoscf_temp_masked)
+
+
+def Figures_Run():
+    partials = oa.Aggregates_Read(ta.monthly_aggregates_path)
+    return ta.Figures_Render(ta.Figure_Frames(partials, ta.figure_year),
+                             partials.lat.values, partials.lon.values)
+
+
+stages = [
+    {'name': 'pull',
+     'inputs': lambda: [],
+     'params': lambda: [gdp.years, [int(m) for m in gdp.months],
+                        gdp.collections, gdp.local_hours,
+                        [gdp.min_lon, gdp.min_lat, gdp.max_lon,
+                         gdp.max_lat], gdp.store_float32],
+     'outputs': Pull_Outputs,
+     'run': Pull_Run,
+     'complete': Pull_Complete},
+    {'name': 'afternoon',
+     'inputs': Afternoon_Inputs,
+     'params': lambda: [gaa.afternoon_hours, gaa.streaming],
+     'outputs': Afternoon_Outputs,
+     'run': gaa.afternoon_run},
+    {'name': 'align',
+     'inputs': lambda: cache.Read_Inputs(ta.geoscf_path, ta.tropomi_path),
+     'params': lambda: [cache.read_cache_version],
+     'outputs': Align_Outputs,
+     'run': Align_Run},
+    {'name': 'aggregates',
+     'inputs': Align_Outputs,
+     'params': lambda: [ta.no2_temp_products],
+     'outputs': lambda: [ta.monthly_aggregates_path,
+                         ta.valid_days_index_path],
+     'run': Aggregates_Run},
+    {'name': 'figures',
+     'inputs': lambda: [ta.monthly_aggregates_path, ta.us_shapefile,
+                        ta.can_shapefile, ta.mex_shapefile],
+     'params': lambda: [ta.figure_path, ta.figure_year],
+     'outputs': lambda: [],
+     'run': Figures_Run}]
+
+
+############################## Running Stages ################################
+
+# function to tell why a stage must run, None when it is up to date
+def Stage_Reason(stage, record, fingerprint, force=()):
+    if stage['name'] in force:
+        return 'forced'
+    if record is None:
+        return 'never run'
+    missing = [x for x in stage['outputs']() + record['outputs']
+               if not os.path.exists(x)]
+    if missing:
+        return 'missing '+missing[0]
+    if record['fingerprint'] != fingerprint:
+        return 'inputs changed'
+    if 'complete' in stage and not stage['complete']():
+        return 'incomplete'
+    return None
+
+
+# function to run the stages that are out of date
+# force is a list of stage names run even if up to date, 'all' for every...
+# ...stage
+# returns the time taken by each stage run, in seconds
+def Run_Pipeline(stages=stages, force=(), state_path=state_file):
+
+    names = [stage['name'] for stage in stages]
+    if 'all' in force:
+        force = names
+    for name in force:
+        if name not in names:
+            raise ValueError('no stage '+name+', the stages are '+
+                             ', '.join(names))
+    state = Load_State(state_path)
+    timings = {}
+
+    for stage in stages:
+        name = stage['name']
+        fingerprint = Fingerprint(stage['inputs'](), stage['params']())
+        reason = Stage_Reason(stage, state.get(name), fingerprint, force)
+        if reason is None:
+            print(name, 'up to date')
+            continue
+
+        print(name, 'running (', reason, ')')
+        start = time.perf_counter()
+        written = stage['run']() or []
+        timings[name] = time.perf_counter() - start
+        print(name, 'finished in', round(timings[name], 1), 's')
+
+        # the fingerprint from before the run is recorded, so inputs...
+        # ...changed while the stage ran are picked up next time
+        state[name] = {'fingerprint': fingerprint,
+                       'outputs': list(written),
+                       'seconds': timings[name],
+                       'finished': time.strftime('%Y-%m-%d %H:%M:%S')}
+        Save_State(state, state_path)
+
+    for name, seconds in timings.items():
+        print('{:<12}{:>10.1f} s'.format(name, seconds))
+    print('{:<12}{:>10.1f} s'.format('total', sum(timings.values())))
+
+    return timings
+
+
+if __name__ == '__main__':
+    Run_Pipeline(force=sys.argv[1:])
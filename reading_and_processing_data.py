@@ -8,17 +8,67 @@ Created on Thu Jul 27 14:27:56 2023
 
 import numpy as np  
 import xarray as xr
-import pandas as pd 
-import geopandas as gpd
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
 import pickle
 import os
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import geoscf_store as gs
+import tropomi_catalogue as tcat
+import colocation_mask as cmask
 
 
 #################### Reading in GEOS-CF and TROPOMI data #####################
 
-def GeosCF_Tropomi_Read(geoscf_files_path, tropomi_files_path): 
+# number of days per chunk of the lazily evaluated (dask) arrays 
+lazy_days = 31
+
+# default directory of cached data (see aligned_cache.py) 
+cache_path = os.path.expanduser('~/.cache/conus_no2_variability/')
+
+# number of worker processes reading TROPOMI files 
+tropomi_workers = min(8, os.cpu_count() or 1)
+
+# reading an afternoon averaged GEOS-CF variable 
+# from its store (geocf_afternoon_ave_<name>.nc) written by...
+# ...geoscf_afternoon_averages.py, or from the older pickle file 
+# lazy returns a chunked dask array that is only read when it is used 
+def Afternoon_Read(geoscf_usa_path, name, key, lazy=False): 
+    store_path = geoscf_usa_path+'geocf_afternoon_ave_'+name+'.nc'
+    chunks = {'date': lazy_days} if lazy else None
+    if os.path.exists(store_path): 
+        return gs.store_open(store_path, key, chunks=chunks)
+    with open(geoscf_usa_path+'geocf_afternoon_ave_'+name+'.pkl', 
+              "rb") as file_in: 
+        array = pickle.load(file_in)[key]
+    if lazy: 
+        array = array.chunk(chunks)
+    return array
+
+# reading the lat/lon window of one TROPOMI file (one day of data) 
+# only the window's hyperslab is read from the file 
+# each file holds a single day (checked against the catalogue before...
+# ...reading, see GeosCF_Tropomi_Read) 
+def Tropomi_Window_Read(path, lat_bounds, lon_bounds): 
+    with xr.open_dataset(path, engine='netcdf4') as array: 
+        return array.value.sel(lat=slice(*lat_bounds), 
+                               lon=slice(*lon_bounds)).isel(time=0).values
+
+# with lazy=True all seven arrays are returned as lazily evaluated, chunked...
+# ...dask arrays: reading, unit scaling, cropping and cloud masking are...
+# ...only carried out (fused, one chunk at a time) when a consumer such as...
+# ...Temporal_Averages reduces them or .compute() is called 
+# catalogue_file is the TROPOMI file catalogue (see tropomi_catalogue.py)...
+# ...by default in cache_path (see Catalogue_Path) 
+# the shared lat/lon and date window is found before any TROPOMI data...
+# ...is read, and n_workers processes read the files in that window 
+# extra_masks (e.g. a QA threshold or land cover, True where data is...
+# ...kept) are combined with the TROPOMI cloud mask 
+def GeosCF_Tropomi_Read(geoscf_files_path, tropomi_files_path, 
+                        lazy=False, catalogue_file=None, 
+                        n_workers=tropomi_workers, extra_masks=(), 
+                        float32=False): 
     
     ################################ GEOS-CF #################################
 
@@ -26,100 +76,57 @@ def GeosCF_Tropomi_Read(geoscf_files_path, tropomi_files_path):
     # processing code in: nox_temp_correlation_data_processing.pynb
     geoscf_usa_path = geoscf_files_path
     
-    # loading no2 data in lowest gridbox
-    afternoon_no2_data = pickle.load(open(
-        geoscf_usa_path+'geocf_afternoon_ave_no2.pkl', "rb"))
-    # storing afternoon ave data as array
-    afternoon_no2_array_0 = afternoon_no2_data['no2_ave'] 
+    # loading no2 data in lowest gridbox as array
+    afternoon_no2_array_0 = Afternoon_Read(geoscf_usa_path, 'no2', 
+                                           'no2_ave', lazy)
     
     # converting values to same units as tropomi, molec/cm^3
     afternoon_no2_array = afternoon_no2_array_0 * 1e15     
     
-    # loading column no2 data
-    afternoon_column_data = pickle.load(open(
-        geoscf_usa_path+'geocf_afternoon_ave_column.pkl', "rb")) 
-    # storing afternoon column data as array
-    afternoon_column_array_0 = afternoon_column_data['col_ave']  
+    # loading column no2 data as array
+    afternoon_column_array_0 = Afternoon_Read(geoscf_usa_path, 'column', 
+                                              'col_ave', lazy)
     
     # converting values to same units as tropomi,  molec/cm^3 
     afternoon_column_array = afternoon_column_array_0 * 1e15  
     
-    # loading temperature data
-    afternoon_temp_data = pickle.load(open(
-        geoscf_usa_path+'geocf_afternoon_ave_temp.pkl', "rb")) 
-    # storing temperature data as array 
-    afternoon_temp_array = afternoon_temp_data['temp_ave']
+    # loading temperature data as array 
+    afternoon_temp_array = Afternoon_Read(geoscf_usa_path, 'temp', 
+                                          'temp_ave', lazy)
     
 
-   ################################ TROPOMI ##################################
-
-    # reading in TROPOMI data regridded to align with GEOS-CF
+   ########## finding the lat, lon and dates shared by both datasets #########
+    
+    # TROPOMI files regridded to align with GEOS-CF
     # regridding code from Kang Sun at University at Buffalo, NY
 
-    # retrieving names of all regridded files in a list 
-    filepath = tropomi_files_path
-    tropomi_filename_list = os.listdir(filepath) 
-    
-    # sorting filenames by date 
-    tropomi_filename_list_sorted = [] 
-    for x in sorted(tropomi_filename_list):
-        tropomi_filename_list_sorted.append(x)
-    
-    # reading in each file as an xarray 
-    def netcdf_to_xarray(filepath, filename): 
-        xarray = xr.open_dataset(filepath+'/'+filename, 
-                                 engine='netcdf4')
-        return xarray 
-    
-    # storing xarrays in a list for now 
-    tropomi_array_list = []
-    for filename in tropomi_filename_list_sorted: 
-        array = netcdf_to_xarray(filepath, filename)
-        no2_array = array.value
-        tropomi_array_list.append(no2_array)
-        
-    # sorted lists of directory contents 
-    new_trop_path = '/projectnb/atmchem/rhmooers/tropomi_regrid/'
-    dir_list = sorted(os.listdir(new_trop_path))
-    
-    raw_data_dir = '/projectnb/atmchem/shared/tropomi/tropomi_pal/conus/'
-    raw_dir_list = sorted(os.listdir(raw_data_dir))
-    
-    # concatenating tropomi xarrays along time axis 
-    tropomi_array = tropomi_array_list[0]
-    for i in range(1, len(tropomi_array_list)): 
-        tropomi_array =  xr.concat([tropomi_array, 
-                                    tropomi_array_list[i]], 
-                                   dim='time')
-        
-    # creating date array to attatch to tropomi array
-    # extracting first date from filename 
+    # retrieving names of all regridded files and their dates...
+    # ...sorted by date, from the catalogue of the TROPOMI directory 
+    # only files that are new or changed since the last run are opened 
     filepath = tropomi_files_path
-    first_file_string = str(os.listdir(filepath)[0])
-    date_string = first_file_string[-11:-3] # start date 
-    first_date = datetime.strptime(date_string, '%Y%d%m') # in dt format 
-    # create list of dates with length equal to lenth of concatenated array
-    # -1 to length accounts for exclusion of last day of data...
-    # ...due to missing values when converted from UTC to local time
-    date_list = [first_date + timedelta(days=x) 
-                 for x in range(len(tropomi_array.time.values)-1)]
-    
-    # changing time coordinate to dates list 
-    tropomi_array.reset_index(['time'], drop = True)
-    end_len = len(tropomi_array.time.values)-1
-    tropomi_array = tropomi_array.isel(time=slice(0, end_len))
-    tropomi_array.coords['time'] = date_list
-    tropomi_array = tropomi_array.rename({'time': 'date'})
-    # time coordinate now contains dates in datetime format 
-
-
-    ########## adjusting the lat and lon on both datasets to match ###########
-    
-    # spatial max and min for tropomi and geoscf 
-    tropomi_min_lat = tropomi_array.lat.values.min()
-    tropomi_max_lat = tropomi_array.lat.values.max()
-    tropomi_min_lon = tropomi_array.lon.values.min()
-    tropomi_max_lon = tropomi_array.lon.values.max()
+    if catalogue_file is None: 
+        catalogue_file = tcat.Catalogue_Path(filepath, cache_path)
+    catalogue = tcat.Tropomi_Catalogue(filepath, catalogue_file)
+    tropomi_filename_list_sorted, tropomi_file_dates = tcat.Catalogue_Files(
+        catalogue)
+    if not tropomi_filename_list_sorted: 
+        raise ValueError('no TROPOMI files in '+str(filepath))
+    
+    # each file is read as the single day of its filename 
+    multi_time = [x for x in tropomi_filename_list_sorted 
+                  if catalogue[x]['shape'][0] != 1]
+    if multi_time: 
+        raise ValueError(str(len(multi_time))+' TROPOMI files hold more '+
+                         'than one timestep (e.g. '+multi_time[0]+
+                         '), expected one day per file')
+    
+    # spatial max and min for tropomi (from the catalogue, without...
+    # ...opening any files) and geoscf 
+    entries = catalogue.values()
+    tropomi_min_lat = max(x['min_lat'] for x in entries)
+    tropomi_max_lat = min(x['max_lat'] for x in entries)
+    tropomi_min_lon = max(x['min_lon'] for x in entries)
+    tropomi_max_lon = min(x['max_lon'] for x in entries)
     geoscf_min_lat = afternoon_no2_array.lat.values.min()
     geoscf_max_lat = afternoon_no2_array.lat.values.max()
     geoscf_min_lon = afternoon_no2_array.lon.values.min()
@@ -132,9 +139,11 @@ def GeosCF_Tropomi_Read(geoscf_files_path, tropomi_files_path):
     max_lon = min(tropomi_max_lon, geoscf_max_lon)
     
     # extracting earliest and latest dates from each dataset
-    trop_firstdate = tropomi_array.date.values[0]
-    trop_lastdate = tropomi_array.date.values[len(
-        tropomi_array.date.values)-1]
+    # the last TROPOMI file is excluded due to missing values...
+    # ...when converted from UTC to local time (unless it is the only file) 
+    trop_firstdate = tropomi_file_dates[0].astype('datetime64[ns]')
+    trop_lastdate = tropomi_file_dates[max(len(tropomi_file_dates)-2, 0)
+                                       ].astype('datetime64[ns]')
     geos_firstdate1 = afternoon_no2_array.date.values[0]
     geos_lastdate1 = afternoon_no2_array.date.values[len(
         afternoon_no2_array.date.values)-1]
@@ -151,14 +160,67 @@ def GeosCF_Tropomi_Read(geoscf_files_path, tropomi_files_path):
     lastdate = min([trop_lastdate, geos_lastdate1, 
                     geos_lastdate2, geos_lastdate3]) 
     # ^excluding last day becasue of NaN values in GEOS-CF dataset
-    
-    # cropped tropomi column NO2
-    tropomi_col_no2 = tropomi_array.sel(lat=slice(min_lat, 
-                                                  max_lat),
-                                        lon=slice(min_lon, 
-                                                  max_lon), 
-                                        date=slice(firstdate,
-                                                   lastdate))
+
+
+    ################################ TROPOMI ##################################
+
+    # reading only the files in the shared date range and only the...
+    # ...shared lat/lon window of each, so memory holds the cropped data 
+    window_filenames, window_dates = tcat.Catalogue_Files(
+        catalogue, firstdate, lastdate)
+    window_paths = [os.path.join(filepath, x) for x in window_filenames]
+    
+    # days without a TROPOMI file are all-NaN days (no data) 
+    # so the record lines up day by day with GEOS-CF 
+    date_list = np.arange(firstdate.astype('datetime64[D]'), 
+                          lastdate.astype('datetime64[D]') 
+                          + np.timedelta64(1, 'D'))
+    
+    # lat and lon of the window, from the first file's coordinates 
+    with xr.open_dataset(window_paths[0], engine='netcdf4') as first: 
+        window = first.value.sel(lat=slice(min_lat, max_lat), 
+                                 lon=slice(min_lon, max_lon))
+        lat = window.lat.values
+        lon = window.lon.values
+    
+    if lazy: 
+        # one dask chunk per file, each only reads its window when used 
+        tropomi_array_list = []
+        for path in window_paths: 
+            array = xr.open_dataset(path, engine='netcdf4', chunks={})
+            tropomi_array_list.append(array.value.sel(
+                lat=slice(min_lat, max_lat), 
+                lon=slice(min_lon, max_lon)).isel(time=0, drop=True))
+        tropomi_array = xr.concat(tropomi_array_list, dim='date')
+        tropomi_array.coords['date'] = window_dates.astype('datetime64[ns]')
+        tropomi_array = tropomi_array.reindex(
+            date=date_list.astype('datetime64[ns]')).chunk(
+                {'date': lazy_days})
+    else: 
+        # files are read in parallel by worker processes (netCDF reads...
+        # ...in one process are serialised) straight into their day of...
+        # ...a preallocated array 
+        tropomi_values = np.full((len(date_list), len(lat), len(lon)), 
+                                 np.nan)
+        day_index = (window_dates - date_list[0]).astype(int)
+        with ProcessPoolExecutor(max_workers=n_workers) as pool: 
+            results = pool.map(Tropomi_Window_Read, window_paths, 
+                               repeat((min_lat, max_lat)), 
+                               repeat((min_lon, max_lon)), 
+                               chunksize=8)
+            for i, values in zip(day_index, results): 
+                tropomi_values[i] = values
+        tropomi_array = xr.DataArray(
+            tropomi_values, name='value', 
+            coords=[('date', date_list.astype('datetime64[ns]')), 
+                    ('lat', lat), ('lon', lon)])
+    # date coordinate contains dates in datetime format 
+    
+    
+    ############## cropping GEOS-CF to the shared lat/lon/dates ##############
+    
+    # tropomi column NO2, already cropped when read
+    tropomi_col_no2 = tropomi_array
     # cropped geoscf lowest-gridbox NO2
     geoscf_surf_no2 = afternoon_no2_array.sel(lat=slice(min_lat, 
                                                         max_lat),
@@ -187,22 +249,17 @@ def GeosCF_Tropomi_Read(geoscf_files_path, tropomi_files_path):
     # filtering data so values that are excluded from... 
     # TROPOMI due to cloud cover are also excluded from GEOS-CF 
     
-    # creating mask for locations of NaN values in TROPOMI array 
-    # nan locations are 1, all other data locations are 0
-    tropomi_col_no2_copy = tropomi_col_no2.copy(deep=True)
-    tropomi_mask = tropomi_col_no2_copy.notnull()
-    
-    # applying the mask to change geos-cf values...
-    # ...to nan where tropomi values are nan
-    geoscf_col_no2_masked = xr.where(tropomi_mask == True, 
-                                     geoscf_col_no2, 
-                                     tropomi_col_no2)
-    geoscf_surf_no2_masked = xr.where(tropomi_mask == True, 
-                                      geoscf_surf_no2, 
-                                      tropomi_col_no2)
-    geoscf_temp_masked = xr.where(tropomi_mask == True, 
-                                  geoscf_temp, 
-                                  tropomi_col_no2)
+    # one validity mask (where TROPOMI has data) is applied to all three...
+    # ...GEOS-CF variables in one pass, each copied once into its output 
+    # (float32 outputs if float32=True) 
+    masked = cmask.Colocation_Mask(
+        tropomi_col_no2, {'geoscf_col_no2': geoscf_col_no2, 
+                          'geoscf_surf_no2': geoscf_surf_no2, 
+                          'geoscf_temp': geoscf_temp}, 
+        extra_masks=extra_masks, float32=float32)
+    geoscf_col_no2_masked = masked.geoscf_col_no2
+    geoscf_surf_no2_masked = masked.geoscf_surf_no2
+    geoscf_temp_masked = masked.geoscf_temp
     
     return (tropomi_col_no2, geoscf_col_no2, 
             geoscf_surf_no2, geoscf_temp, 
@@ -221,7 +278,21 @@ def GeosCF_Tropomi_Read(geoscf_files_path, tropomi_files_path):
 
 ############################### Shapefiles ###################################
 
-def Shapefile_Read(us_path, can_path, mex_path):
+# simplification tolerances (degrees) of the boundaries for map zooms 
+# 'full' keeps every vertex of the shapefiles 
+boundary_tolerances = {'full': None, 
+                       'regional': 0.005, 
+                       'conus': 0.02, 
+                       'continental': 0.05}
+
+# geopandas (with pandas) and shapely are only imported by the shapefile...
+# ...functions, so reading GEOS-CF and TROPOMI data (e.g. in worker...
+# ...processes) does not load them 
+
+# reading the three shapefiles into one dataframe of states/provinces 
+def Shapefile_Combine(us_path, can_path, mex_path):
+    import pandas as pd 
+    import geopandas as gpd
 
     # United States 
     us_file = us_path
@@ -256,9 +327,71 @@ def Shapefile_Read(us_path, can_path, mex_path):
     
     return states 
 
+# modification times and sizes of the files making up a shapefile...
+# ...(.shp, .dbf, .shx, .prj, ...) 
+def Shapefile_Stats(path): 
+    directory, filename = os.path.split(os.path.abspath(path))
+    stem = os.path.splitext(filename)[0]
+    stats = []
+    for name in sorted(os.listdir(directory)): 
+        if os.path.splitext(name)[0] == stem: 
+            file_stat = os.stat(os.path.join(directory, name))
+            stats.append([name, file_stat.st_mtime_ns, file_stat.st_size])
+    return stats
+
+# the combined dataframe is cached as GeoParquet in cache_path, keyed on...
+# ...the modification times of the shapefiles, so the shapefiles are...
+# ...only read and reprojected again when one of them changes 
+# simplify is a level of boundary_tolerances (or a tolerance in degrees) 
+# each country is simplified as a coverage, so shared borders between...
+# ...states/provinces stay shared (no gaps or overlaps), and each...
+# ...simplification level is cached too 
+def Shapefile_Read(us_path, can_path, mex_path, simplify='full', 
+                   cache_path=cache_path):
+    import geopandas as gpd
+    import shapely
+    
+    tolerance = boundary_tolerances.get(simplify, simplify)
+    sources = [[os.path.abspath(x), Shapefile_Stats(x)] 
+               for x in (us_path, can_path, mex_path)]
+    key = hashlib.sha256(json.dumps(sources).encode()).hexdigest()[:16]
+    full_file = os.path.join(cache_path, 'boundaries_'+key+'.parquet')
+    level_file = os.path.join(cache_path, 
+                              'boundaries_'+key+'_'+str(tolerance)+'.parquet')
+    
+    if tolerance and os.path.exists(level_file): 
+        return gpd.read_parquet(level_file)
+    
+    if os.path.exists(full_file): 
+        states = gpd.read_parquet(full_file)
+    else: 
+        states = Shapefile_Combine(us_path, can_path, mex_path)
+        states = states.reset_index(drop=True)
+        Parquet_Save(states, full_file)
+    
+    if not tolerance: 
+        return states
+    
+    states = states.copy()
+    for country in states['country'].unique(): 
+        rows = (states['country'] == country).values
+        states.loc[rows, 'geometry'] = shapely.coverage_simplify(
+            states.geometry.values[rows], tolerance)
+    Parquet_Save(states, level_file)
+    return states 
+
+# writing a GeoParquet file, renamed into place when complete 
+def Parquet_Save(dataframe, filename): 
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_file = filename+'.tmp'+str(os.getpid())
+    dataframe.to_parquet(tmp_file)
+    os.replace(tmp_file, filename)
+
 
 # testing shapefile function 
 '''
+import matplotlib.pyplot as plt
+
 states = Shapefile_Read('/projectnb/atmchem/shared/shapefiles/cb_2018_us_state_500k/cb_2018_us_state_500k.shp', 
                '/projectnb/atmchem/rhmooers/shapefiles/canada/lpr_000b16a_e.shp', 
                '/projectnb/atmchem/rhmooers/shapefiles/mexico/mex_admbnda_adm1_govmex_20210618.shp')
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:47:19 2026
+
+@author: rhmooers
+"""
+
+##### Gridded Index of States, Provinces and Regions #####
+
+# the polygons from Shapefile_Read are rasterised once onto the...
+# ...GEOS-CF/TROPOMI grid as a list of (gridbox, region, weight) entries
+# weights are the fraction of the gridbox inside the region times the...
+# ...gridbox area (proportional to the cosine of its latitude), or with...
+# ...fractions=False the gridbox area for gridboxes whose centre is in...
+# ...the region
+# the index is cached next to the aligned arrays (see aligned_cache.py)...
+# ...keyed on the shapefiles and the grid, so rasterising is only repeated...
+# ...when either changes
+# regional means of every region (or of groups of regions) are then one...
+# ...weighted bincount over the gridboxes, with no point-in-polygon tests
+
+import numpy as np
+import xarray as xr
+import os
+import reading_and_processing_data as read
+import aligned_cache as cache
+
+
+# function to give the edges of gridboxes from their centres
+# edges are half way between centres, the outer edges half a gridbox out
+def Grid_Edges(centres):
+    centres = np.asarray(centres, dtype=np.float64)
+    middle = (centres[1:] + centres[:-1]) / 2
+    return np.concatenate([[2*centres[0] - middle[0]], middle,
+                           [2*centres[-1] - middle[-1]]])
+
+
+# function to rasterise the polygons of a GeoDataFrame onto a lat/lon grid
+# returns the index as a dict of arrays: names and countries of the...
+# ...regions, and for each entry the flattened gridbox (lat*n_lon + lon),
+# ...the region number and the weight
+# geopandas and shapely are imported here, only when an index is built
+def Rasterise_Regions(states, lat, lon, fractions=True):
+    import geopandas as gpd
+    import shapely
+
+    states = states.reset_index(drop=True)
+    lat_edges = Grid_Edges(lat)
+    lon_edges = Grid_Edges(lon)
+    lat_2d, lon_2d = np.meshgrid(np.arange(len(lat)), np.arange(len(lon)),
+                                 indexing='ij')
+    lat_2d = lat_2d.ravel()
+    lon_2d = lon_2d.ravel()
+
+    if fractions:
+        gridboxes = shapely.box(lon_edges[lon_2d], lat_edges[lat_2d],
+                                lon_edges[lon_2d+1], lat_edges[lat_2d+1])
+        predicate = 'intersects'
+    else:
+        gridboxes = shapely.points(np.asarray(lon)[lon_2d],
+                                   np.asarray(lat)[lat_2d])
+        predicate = 'within'
+    gridboxes = gpd.GeoDataFrame(geometry=gridboxes, crs=states.crs)
+
+    pairs = gpd.sjoin(gridboxes, states[['geometry']], how='inner',
+                      predicate=predicate)
+    cells = pairs.index.values
+    regions = pairs['index_right'].values
+
+    if fractions:
+        inside = shapely.intersection(gridboxes.geometry.values[cells],
+                                      states.geometry.values[regions])
+        weights = (shapely.area(inside) /
+                   shapely.area(gridboxes.geometry.values[cells]))
+    else:
+        # a centre on a shared border is given to one region only
+        cells, first = np.unique(cells, return_index=True)
+        regions = regions[first]
+        weights = np.ones(len(cells))
+
+    weights = weights * np.cos(np.deg2rad(np.asarray(lat)[lat_2d[cells]]))
+    keep = weights > 0
+    return {'names': np.asarray(states['name'], dtype=str),
+            'countries': np.asarray(states['country'], dtype=str),
+            'cells': cells[keep].astype(np.int64),
+            'regions': regions[keep].astype(np.int64),
+            'weights': weights[keep],
+            'lat': np.asarray(lat, dtype=np.float64),
+            'lon': np.asarray(lon, dtype=np.float64)}
+
+
+# function to give the index of the states and provinces read by...
+# ...Shapefile_Read on a lat/lon grid, from the cache when the shapefiles...
+# ...and grid are unchanged, otherwise rasterised and saved
+def Region_Index(us_path, can_path, mex_path, lat, lon, fractions=True,
+                 cache_path=cache.read_cache_path):
+
+    shapefiles = []
+    for path in (us_path, can_path, mex_path):
+        file_stat = os.stat(path)
+        shapefiles.append([os.path.abspath(path), file_stat.st_mtime_ns,
+                           file_stat.st_size])
+    key = cache.Hash([shapefiles, np.round(lat, 6).tolist(),
+                      np.round(lon, 6).tolist(), fractions])
+    index_file = os.path.join(cache_path, 'region_index_'+key+'.npz')
+
+    if os.path.exists(index_file):
+        with np.load(index_file) as saved:
+            return {name: saved[name] for name in saved.files}
+
+    states = read.Shapefile_Read(us_path, can_path, mex_path)
+    index = Rasterise_Regions(states, lat, lon, fractions)
+    os.makedirs(cache_path, exist_ok=True)
+    tmp_file = index_file[:-len('.npz')]+'.tmp'+str(os.getpid())+'.npz'
+    np.savez(tmp_file, **index)
+    os.replace(tmp_file, index_file)
+    return index
+
+
+# function to combine the regions of an index into groups of regions
+# groupings is a dict of {group name: [region names]}, e.g.
+# {'Northeast': ['New York', 'Vermont', ...], 'Ontario': ['Ontario']}
+# regions not in any group are left out
+def Group_Regions(index, groupings):
+    group_names = list(groupings)
+    group_of = np.full(len(index['names']), -1)
+    for i, group in enumerate(group_names):
+        members = np.isin(index['names'], groupings[group])
+        if not members.any():
+            raise ValueError('none of the regions of '+group+
+                             ' are in the index')
+        group_of[members] = i
+    regions = group_of[index['regions']]
+    keep = regions >= 0
+    grouped = dict(index)
+    grouped.update({'names': np.array(group_names, dtype=str),
+                    'countries': np.array([''] * len(group_names)),
+                    'cells': index['cells'][keep],
+                    'regions': regions[keep],
+                    'weights': index['weights'][keep]})
+    return grouped
+
+
+# function to add up weighted values of the gridboxes of each region
+# values is a (n, lat*lon) array, returns a (n, region) array of the sums...
+# ...of weight*value over the entries of each region
+def Weighted_Bincount(values, index):
+    n_regions = len(index['names'])
+    entries = values[:, index['cells']] * index['weights']
+    slots = (np.arange(len(values))[:, np.newaxis] * n_regions +
+             index['regions']).ravel()
+    return np.bincount(slots, weights=entries.ravel(),
+                       minlength=len(values) * n_regions).reshape(
+                           (len(values), n_regions))
+
+
+# function to check that an array is on the grid of an index and give...
+# ...its values as (n, lat*lon) with the leading dimensions flattened
+def Grid_Values(array, index):
+    if array.dims[-2:] != ('lat', 'lon') or not (
+            np.allclose(array.lat.values, index['lat'])
+            and np.allclose(array.lon.values, index['lon'])):
+        raise ValueError('array is not on the grid of the region index')
+    return array.values.reshape((-1, len(index['lat']) * len(index['lon'])))
+
+
+# function to give the area-weighted mean of each region
+# array has lat and lon as its last dimensions (e.g. daily or monthly...
+# ...(date, lat, lon) averages), NaN gridboxes are left out
+# chunk is the number of steps of the leading dimension reduced at a time
+# returns an array with the leading dimensions and a region dimension
+def Regional_Means(array, index, chunk=31):
+    leading = array.dims[:-2]
+    means = []
+    for start in range(0, array.shape[0] if leading else 1, chunk):
+        if leading:
+            part = array.isel({leading[0]: slice(start, start+chunk)})
+        else:
+            part = array
+        values = Grid_Values(part, index)
+        valid = ~np.isnan(values)
+        sums = Weighted_Bincount(np.where(valid, values, 0), index)
+        areas = Weighted_Bincount(valid.astype(np.float64), index)
+        with np.errstate(invalid='ignore'):
+            means.append(sums / areas)
+    means = np.concatenate(means)
+
+    coords = {x: array[x].values for x in leading}
+    coords['region'] = index['names']
+    return xr.DataArray(means.reshape(array.shape[:-2] + (-1,)),
+                        dims=leading + ('region',), coords=coords,
+                        name=array.name)
+
+
+# function to reduce gridded partials (see temporal_aggregation.py) to...
+# ...regional partials, the weighted sums of each _sum and _count
+# the functions of temporal_aggregation.py (e.g. Monthly_Means,...
+# ...Seasonal_Means, Monthly_Climatology) then give regional averages...
+# ...over all days and gridboxes of each region with data
+def Regional_Partials(partials, index):
+    regional = {}
+    for name, variable in partials.data_vars.items():
+        if name.endswith('_sum') or name.endswith('_count'):
+            regional[name] = (('date', 'region'), Weighted_Bincount(
+                Grid_Values(variable, index).astype(np.float64), index))
+    return xr.Dataset(regional, coords={'date': partials.date.values,
+                                        'region': index['names']})
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:02:53 2026
+
+@author: rhmooers
+"""
+
+##### Per-Pixel NO2-Temperature Correlation and Regression #####
+
+# for every pixel, the daily NO2 values are related to the daily...
+# ...temperatures over the days both have data (NaN days are skipped)
+# gives the number of days, the Pearson and Spearman correlations and...
+# ...the slope and intercept of the least-squares line NO2 = a + b*T
+# all pixels of a band of latitudes are computed together as columns of...
+# ...one array, so no loop over pixels is needed and memory holds one...
+# ...band of the record at a time
+# optionally computed separately for each calendar month or season...
+# ...(all years of that month or season together)
+
+import numpy as np
+import xarray as xr
+import temporal_aggregation as agg
+
+
+# function to rank the values of each column of a (day, pixel) array
+# equal values get the average of their ranks, NaN values stay NaN
+def Column_Ranks(values):
+    n = values.shape[0]
+    order = np.argsort(values, axis=0)
+    ordered = np.take_along_axis(values, order, axis=0)
+    position = np.arange(n).reshape((n,) + (1,) * (values.ndim - 1))
+
+    # first and last position of each run of equal values
+    new_run = np.ones(values.shape, dtype=bool)
+    new_run[1:] = ordered[1:] != ordered[:-1]
+    end_run = np.ones(values.shape, dtype=bool)
+    end_run[:-1] = new_run[1:]
+    first = np.maximum.accumulate(np.where(new_run, position, 0), axis=0)
+    last = np.flip(np.minimum.accumulate(
+        np.flip(np.where(end_run, position, n), axis=0), axis=0), axis=0)
+
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, (first + last) / 2 + 1, axis=0)
+    ranks[np.isnan(values)] = np.nan
+    return ranks
+
+
+# function to give count, correlation and least-squares line of the...
+# ...columns of two (day, pixel) arrays, over the days both have data
+# the data is centred on each pixel's means before multiplying...
+# ...so the large NO2 values (~1e15) do not lose precision
+def Column_Statistics(x, y):
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    count = np.sum(valid, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n = np.where(count > 0, count, np.nan)
+        x_mean = np.sum(np.where(valid, x, 0), axis=0) / n
+        y_mean = np.sum(np.where(valid, y, 0), axis=0) / n
+        dx = np.where(valid, x - x_mean, 0)
+        dy = np.where(valid, y - y_mean, 0)
+        sxx = np.sum(dx * dx, axis=0)
+        syy = np.sum(dy * dy, axis=0)
+        sxy = np.sum(dx * dy, axis=0)
+        correlation = sxy / np.sqrt(sxx * syy)
+        slope = sxy / sxx
+    intercept = y_mean - slope * x_mean
+    # at least three days are needed for a meaningful fit
+    too_few = count < 3
+    for array in (correlation, slope, intercept):
+        array[too_few] = np.nan
+    return count, correlation, slope, intercept
+
+
+# function to relate NO2 to temperature at every pixel
+# no2 and temp are (date, lat, lon) DataArrays on the same grid (e.g....
+# ...geoscf_surf_no2_masked and geoscf_temp_masked), which may be...
+# ...lazily loaded, chunk_lats latitudes are read at a time
+# group is None (all days), 'month' or 'season'
+# returns a Dataset of count, pearson, spearman, slope (NO2 per K) and...
+# ...intercept, with a month or season dimension if grouped
+def Pixel_Regression(no2, temp, group=None, chunk_lats=16):
+
+    if no2.dims != temp.dims or no2.shape != temp.shape:
+        raise ValueError('no2 '+str(dict(no2.sizes))+' and temp '+
+                         str(dict(temp.sizes))+' are not on the same grid')
+
+    months = no2.date.values.astype('datetime64[M]').astype(int) % 12 + 1
+    if group is None:
+        labels = np.zeros(len(months), dtype=int)
+        groups = [0]
+    elif group == 'month':
+        labels = months
+        groups = list(range(1, 13))
+    elif group == 'season':
+        labels = (months % 12) // 3
+        groups = list(range(4))
+    else:
+        raise ValueError("group must be None, 'month' or 'season', not "+
+                         str(group))
+
+    names = ('count', 'pearson', 'spearman', 'slope', 'intercept')
+    shape = (len(groups),) + no2.shape[1:]
+    results = {name: np.full(shape, np.nan) for name in names}
+
+    for start in range(0, no2.sizes['lat'], chunk_lats):
+        band = slice(start, start+chunk_lats)
+        y_band = no2.isel(lat=band).values
+        x_band = temp.isel(lat=band).values
+        band_shape = y_band.shape[1:]
+        y_band = y_band.reshape((len(y_band), -1))
+        x_band = x_band.reshape((len(x_band), -1))
+
+        for i, label in enumerate(groups):
+            days = labels == label
+            y = y_band[days]
+            x = x_band[days]
+            count, pearson, slope, intercept = Column_Statistics(x, y)
+
+            # Spearman correlation is the Pearson correlation of the...
+            # ...ranks over the days both have data
+            both = ~np.isnan(x) & ~np.isnan(y)
+            spearman = Column_Statistics(
+                Column_Ranks(np.where(both, x, np.nan)),
+                Column_Ranks(np.where(both, y, np.nan)))[1]
+
+            for name, values in zip(names, (count, pearson, spearman,
+                                            slope, intercept)):
+                results[name][i, band] = values.reshape(band_shape)
+
+    dims = ('group',) + no2.dims[1:]
+    coords = {x: no2[x].values for x in no2.dims[1:]}
+    regression = xr.Dataset({name: (dims, values)
+                             for name, values in results.items()},
+                            coords=coords)
+    regression['count'] = regression['count'].astype(np.int32)
+    if group is None:
+        return regression.isel(group=0, drop=True)
+    if group == 'season':
+        groups = agg.season_names
+    return regression.rename(group=group).assign_coords({group: groups})
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:20:44 2026
+
+@author: rhmooers
+"""
+
+##### Monthly Partial Sums for Averages at Several Resolutions #####
+
+# the daily data of every variable is read once, one month at a time, and...
+# ...reduced to a sum and a count of valid (non-NaN) days per pixel
+# averages over months, years, seasons and multi-year climatologies are...
+# ...then sums of these monthly partials divided by the summed counts...
+# ...so they equal the averages of the daily data without reading it again
+
+import numpy as np
+import xarray as xr
+
+
+# names of the seasons, indexed by (month % 12) // 3
+season_names = np.array(['DJF', 'MAM', 'JJA', 'SON'])
+
+
+# function to give the last day of each month (the label used by...
+# ...resample(date='M'))
+def Month_End(months):
+    return ((months + 1).astype('datetime64[D]') -
+            np.timedelta64(1, 'D')).astype('datetime64[ns]')
+
+
+# function to reduce a daily Dataset (date, lat, lon) to monthly partials
+# returns a Dataset with <variable>_sum and <variable>_count for each...
+# ...variable, dated by the last day of the month, covering every month...
+# ...from the first date to the last (months without data have count 0)
+# each month of all variables is loaded together, so lazy (dask)...
+# ...variables sharing inputs (e.g. a mask) compute them once per month
+# squares adds <variable>_sumsq (sums of squares, for variances)
+# products is a list of pairs of variables (x, y) adding, over the days...
+# ...both have data, <x>__<y>_count and the sums <x>__<y>_sumx,...
+# ...<x>__<y>_sumy, <x>__<y>_sumxx, <x>__<y>_sumyy and <x>__<y>_cross...
+# ...(of x*y), for covariances and correlations
+def Monthly_Partials(dataset, squares=False, products=()):
+
+    dates = dataset.date.values.astype('datetime64[M]')
+    months = np.arange(dates[0], dates[-1] + 1)
+    starts = np.searchsorted(dates, months)
+    ends = np.searchsorted(dates, months + 1)
+
+    partials = {}
+    names = list(dataset.data_vars)
+    for name in names:
+        variable = dataset[name]
+        shape = (len(months),) + variable.shape[1:]
+        partials[name+'_sum'] = np.zeros(shape)
+        partials[name+'_count'] = np.zeros(shape, dtype=np.int32)
+        if squares:
+            partials[name+'_sumsq'] = np.zeros(shape)
+    for x, y in products:
+        pair = x+'__'+y
+        partials[pair+'_count'] = np.zeros(shape, dtype=np.int32)
+        for sum_name in ('_sumx', '_sumy', '_sumxx', '_sumyy', '_cross'):
+            partials[pair+sum_name] = np.zeros(shape)
+
+    for i in range(len(months)):
+        if starts[i] == ends[i]:
+            continue
+        block = dataset.isel(date=slice(starts[i], ends[i])).load()
+        for name in names:
+            values = block[name].values
+            partials[name+'_count'][i] = np.sum(~np.isnan(values), axis=0)
+            partials[name+'_sum'][i] = np.nansum(values, axis=0)
+            if squares:
+                partials[name+'_sumsq'][i] = np.nansum(values**2, axis=0)
+        for x, y in products:
+            pair = x+'__'+y
+            both = ~np.isnan(block[x].values) & ~np.isnan(block[y].values)
+            x_values = np.where(both, block[x].values, 0)
+            y_values = np.where(both, block[y].values, 0)
+            partials[pair+'_count'][i] = np.sum(both, axis=0)
+            partials[pair+'_sumx'][i] = np.sum(x_values, axis=0)
+            partials[pair+'_sumy'][i] = np.sum(y_values, axis=0)
+            partials[pair+'_sumxx'][i] = np.sum(x_values**2, axis=0)
+            partials[pair+'_sumyy'][i] = np.sum(y_values**2, axis=0)
+            partials[pair+'_cross'][i] = np.sum(x_values*y_values, axis=0)
+
+    dims = dataset[names[0]].dims
+    coords = {dim: dataset[dim].values for dim in dims[1:]}
+    coords['date'] = Month_End(months)
+    return xr.Dataset({name: (dims, values)
+                       for name, values in partials.items()},
+                      coords=coords)
+
+
+# function to combine monthly partials into groups of months
+# labels gives the group of each month (e.g. its year), months with...
+# ...the same label are added together
+# returns partials with a dimension dim holding the sorted group labels
+def Group_Partials(partials, labels, dim):
+    groups, index = np.unique(labels, return_inverse=True)
+    grouped = {}
+    for name, variable in partials.data_vars.items():
+        values = np.zeros((len(groups),) + variable.shape[1:],
+                          dtype=variable.dtype)
+        np.add.at(values, index, variable.values)
+        grouped[name] = ((dim,) + variable.dims[1:], values)
+    coords = {x: partials[x].values for x in partials.dims if x != 'date'}
+    coords[dim] = groups
+    return xr.Dataset(grouped, coords=coords)
+
+
+# function to divide partial sums by counts
+# returns a Dataset of the means of each variable (NaN without data)
+def Partial_Means(partials):
+    means = {}
+    for name in partials.data_vars:
+        if name.endswith('_sum'):
+            variable = name[:-len('_sum')]
+            count = partials[variable+'_count']
+            means[variable] = (partials[name] /
+                               count.where(count > 0)).rename(variable)
+    return xr.Dataset(means)
+
+
+# function to give means, variances and covariances from partials
+# variances (of variables with _sumsq) and covariances and correlations...
+# ...(of pairs from Monthly_Partials products, over the days both have...
+# ...data) are sample statistics, NaN with fewer than two days of data
+# returns a Dataset with <variable>_mean, <variable>_variance,...
+# ...<x>__<y>_covariance and <x>__<y>_correlation
+def Partial_Moments(partials):
+    moments = {}
+    for name, average in Partial_Means(partials).data_vars.items():
+        moments[name+'_mean'] = average
+        if name+'_sumsq' in partials:
+            count = partials[name+'_count']
+            moments[name+'_variance'] = (
+                (partials[name+'_sumsq'] - partials[name+'_sum'] * average)
+                / (count - 1).where(count > 1))
+    for name in partials.data_vars:
+        if name.endswith('_cross'):
+            pair = name[:-len('_cross')]
+            count = partials[pair+'_count']
+            n = count.where(count > 1)
+            sumx = partials[pair+'_sumx']
+            sumy = partials[pair+'_sumy']
+            covariance = (partials[name] - sumx * sumy / n) / (n - 1)
+            x_variance = (partials[pair+'_sumxx'] - sumx**2 / n) / (n - 1)
+            y_variance = (partials[pair+'_sumyy'] - sumy**2 / n) / (n - 1)
+            moments[pair+'_covariance'] = covariance
+            moments[pair+'_correlation'] = covariance / np.sqrt(
+                x_variance * y_variance)
+    return xr.Dataset(moments)
+
+
+# monthly means, dated by the last day of each month
+def Monthly_Means(partials):
+    return Partial_Means(partials)
+
+
+# yearly partials, dated by the last day of each year...
+# ...(as resample(date='Y'))
+def Yearly_Partials(partials):
+    years = partials.date.values.astype('datetime64[Y]')
+    year_end = ((years + 1).astype('datetime64[D]') -
+                np.timedelta64(1, 'D')).astype('datetime64[ns]')
+    return Group_Partials(partials, year_end, 'date')
+
+
+# yearly means, dated by the last day of each year
+def Yearly_Means(partials):
+    return Partial_Means(Yearly_Partials(partials))
+
+
+# seasonal (DJF, MAM, JJA, SON) means, dated by the first day of each...
+# ...season, December counting towards the following year's DJF
+# a season coordinate gives the name of each season
+def Seasonal_Means(partials):
+    months = partials.date.values.astype('datetime64[M]')
+    season_start = months - (months.astype(int) % 12 + 1) % 3
+    grouped = Group_Partials(partials, season_start.astype('datetime64[ns]'),
+                             'date')
+    starts = grouped.date.values.astype('datetime64[M]')
+    grouped.coords['season'] = ('date', season_names[
+        (starts.astype(int) % 12 + 1) % 12 // 3])
+    return Partial_Means(grouped)
+
+
+# multi-year climatology of each calendar month (month 1 to 12)
+def Monthly_Climatology(partials):
+    months = partials.date.values.astype('datetime64[M]')
+    return Partial_Means(Group_Partials(partials,
+                                        months.astype(int) % 12 + 1,
+                                        'month'))
+
+
+# multi-year climatology of each season (DJF, MAM, JJA, SON)
+def Seasonal_Climatology(partials):
+    months = partials.date.values.astype('datetime64[M]')
+    seasons = (months.astype(int) % 12 + 1) % 12 // 3
+    climatology = Partial_Means(Group_Partials(partials, seasons, 'season'))
+    climatology.coords['season'] = season_names[climatology.season.values]
+    return climatology
+
+
+# function to remove averages of periods with too few days of data
+# averages are kept where days (the number of days of data in the...
+# ...period) is greater than threshold, and are NaN elsewhere
+def Threshold_Mask(average, days, threshold):
+    return average.where(days > threshold)
+
+
+# function to give, for each period of the partials (e.g. monthly or...
+# ...Yearly_Partials), the number of days of data, the average of each...
+# ...variable and the average of periods with more than threshold days
+# days are counted from count_variable (TROPOMI by default, whose cloud...
+# ...cover the GEOS-CF variables are masked by)
+# returns a Dataset with days, <variable> and <variable>_thresholded
+def Count_Means(partials, threshold=15, count_variable='tropomi_col_no2'):
+    days = partials[count_variable+'_count']
+    means = Partial_Means(partials)
+    counted = {'days': days}
+    for name, average in means.data_vars.items():
+        counted[name] = average
+        counted[name+'_thresholded'] = Threshold_Mask(average, days,
+                                                      threshold)
+    return xr.Dataset(counted)
+
+
+# function to evaluate many day-count thresholds at once
+# for each threshold the averages of every variable are kept where...
+# ...count_variable has more than threshold days of data in the period...
+# ...as Count_Means does for a single threshold
+# the averages are found once and masked for all thresholds together
+# returns a Dataset with a threshold dimension holding the masked...
+# ...averages (threshold, date, lat, lon), retained (the fraction of...
+# ...pixels with data in each period that are kept) and retained_total...
+# ...(the same fraction over all periods)
+def Threshold_Sweep(partials, thresholds=range(5, 26),
+                    count_variable='tropomi_col_no2'):
+    thresholds = np.asarray(thresholds)
+    days = partials[count_variable+'_count'].values
+    keep = days[np.newaxis] > thresholds.reshape((-1,) + (1,) * days.ndim)
+
+    means = Partial_Means(partials)
+    dims = ('threshold',) + means[count_variable].dims
+    swept = {}
+    for name, average in means.data_vars.items():
+        swept[name] = (dims, np.where(keep, average.values[np.newaxis],
+                                      np.nan))
+
+    # fractions of the pixels with any data that are kept
+    with_data = np.sum(days > 0, axis=tuple(range(1, days.ndim)))
+    kept = np.sum(keep, axis=tuple(range(2, keep.ndim)))
+    swept['retained'] = (dims[:2], kept / np.where(with_data > 0,
+                                                   with_data, np.nan))
+    swept['retained_total'] = (('threshold',),
+                               kept.sum(axis=1) / np.sum(days > 0))
+
+    coords = {x: means[x].values for x in means[count_variable].dims}
+    coords['threshold'] = thresholds
+    return xr.Dataset(swept, coords=coords)
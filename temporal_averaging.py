@@ -8,153 +8,142 @@ Created on Thu Jul 27 14:55:06 2023
 
 import xarray as xr
 import calendar
-import matplotlib.cm as cm
+import os
 import reading_and_processing_data as read
-import plotting_functions as pf
+import aligned_cache as cache
+import temporal_aggregation as agg
+import valid_days_index as vdi
+import geoscf_data_pull as gdp
+import online_aggregates as oa
+import temperature_regression as tr
+import region_index as ri
+import batch_rendering as br
 
 
-# reading in data 
-(tropomi_col_no2, geoscf_col_no2, geoscf_surf_no2, geoscf_temp, geoscf_col_no2_masked, 
- geoscf_surf_no2_masked, geoscf_temp_masked) = read.GeosCF_Tropomi_Read(
-     '/projectnb/atmchem/shared/geocf_usa/', 
-     '/projectnb/atmchem/shared/tropomi/tropomi_pal/conus/gridded_geoscf')
+# GEOS-CF afternoon averages (see geoscf_afternoon_averages.py) and...
+# ...gridded TROPOMI files
+geoscf_path = gdp.out_dir
+tropomi_path = '/projectnb/atmchem/shared/tropomi/tropomi_pal/conus/gridded_geoscf'
+
+# state/province shapefiles (see Shapefile_Read) 
+us_shapefile = '/projectnb/atmchem/shared/shapefiles/cb_2018_us_state_500k/cb_2018_us_state_500k.shp'
+can_shapefile = '/projectnb/atmchem/rhmooers/shapefiles/canada/lpr_000b16a_e.shp'
+mex_shapefile = '/projectnb/atmchem/rhmooers/shapefiles/mexico/mex_admbnda_adm1_govmex_20210618.shp'
+
+# stores of the monthly partials (see online_aggregates.py) and of the...
+# ...cumulative count of days with TROPOMI data (see valid_days_index.py)
+monthly_aggregates_path = ('/projectnb/atmchem/rhmooers/geoscf/'
+                           'monthly_aggregates.nc')
+valid_days_index_path = ('/projectnb/atmchem/rhmooers/geoscf/'
+                         'tropomi_valid_days_index.nc')
+
+# NO2-temperature pairs whose cross-products are kept in the partials
+no2_temp_products = [('tropomi_col_no2', 'geoscf_temp'),
+                     ('geoscf_col_no2', 'geoscf_temp'),
+                     ('geoscf_surf_no2', 'geoscf_temp')]
+
+# figures are rendered in parallel to files in figure_path when...
+# ...batch_figures is True, otherwise plotted one at a time with...
+# ...plotting_functions.py (imported only then, with Basemap) 
+batch_figures = True
+figure_path = '/projectnb/atmchem/rhmooers/figures/'
+# year of the maps rendered (e.g. 2020), None for every year with data
+figure_year = None
 
+# the stages of this script (reading, updating the stores, figures) can...
+# ...also be run on their own by pipeline.py, only when their inputs change
+# importing this module reads no data, the analysis runs when it is run...
+# ...as a script
+
+
+################################ Reading Data ################################
+
+# reading in data 
+# (from the cache of the aligned arrays when the input files are unchanged)
+# returns tropomi_col_no2, geoscf_col_no2, geoscf_surf_no2, geoscf_temp...
+# ...and the masked GEOS-CF arrays
+def Aligned_Read():
+    return cache.GeosCF_Tropomi_Cached_Read(geoscf_path, tropomi_path)
 
 
 ################# Monthly and annual averages of variables ###################
 
+# monthly sums and valid-day counts of all four variables, found in...
+# ...one pass over the daily data (see temporal_aggregation.py) 
+def Daily_Partials(tropomi_col_no2, geoscf_col_no2, 
+                   geoscf_surf_no2, geoscf_temp): 
+    daily = xr.Dataset({'tropomi_col_no2': tropomi_col_no2, 
+                        'geoscf_col_no2': geoscf_col_no2, 
+                        'geoscf_surf_no2': geoscf_surf_no2, 
+                        'geoscf_temp': geoscf_temp})
+    return agg.Monthly_Partials(daily)
+
+# monthly and yearly averages, derived from the monthly partials 
+# partials from an earlier call to Daily_Partials can be passed in...
+# ...so the daily data is not read again 
 def Temporal_Averages(tropomi_col_no2, geoscf_col_no2, 
-                      geoscf_surf_no2, geoscf_temp):
-    
-    # taking monthly averages using resample 
-    tropomi_col_no2_month = tropomi_col_no2.resample(
-        date='M').mean()
-    geoscf_col_no2_month = geoscf_col_no2.resample(
-        date='M').mean()
-    geoscf_surf_no2_month = geoscf_surf_no2.resample(
-        date='M').mean()
-    geoscf_temp_month = geoscf_temp.resample(
-        date='M').mean()
-    
-    # yearly average using resample
-    tropomi_col_no2_year = tropomi_col_no2.resample(
-        date='Y').mean()
-    geoscf_col_no2_year = geoscf_col_no2.resample(
-        date='Y').mean()
-    geoscf_surf_no2_year = geoscf_surf_no2.resample(
-        date='Y').mean()
-    geoscf_temp_year = geoscf_temp.resample(
-        date='Y').mean()
-    
-    return (tropomi_col_no2_month, geoscf_col_no2_month, 
-            geoscf_surf_no2_month, geoscf_temp_month, 
-            tropomi_col_no2_year, geoscf_col_no2_year, 
-            geoscf_surf_no2_year, geoscf_temp_year)
-
-# using function to obtain averaged datasets 
-(tropomi_col_no2_month_ave, geoscf_col_no2_month_ave, 
- geoscf_surf_no2_month_ave, geoscf_temp_month_ave, 
- tropomi_col_no2_year_ave, geoscf_col_no2_year_ave, 
- geoscf_surf_no2_year_ave, geoscf_temp_year_ave) = Temporal_Averages(
-     tropomi_col_no2, geoscf_col_no2_masked, geoscf_surf_no2_masked, 
-     geoscf_temp_masked)
-
-# plotting monthly average column NO2
-for month in range(12):
-    # date for plot title 
-    date = tropomi_col_no2_month_ave.date.values[month]
-    full_date = str(date)
-    year = full_date[0:4]
-    
-    pf.Spatial_Plotting_2ax(tropomi_col_no2_month_ave[month,:,:], 
-                         'TROPOMI', 0, 2.5e16,
-                         tropomi_col_no2_month_ave.lon.values, 
-                         tropomi_col_no2_month_ave.lat.values,
-                         cm.get_cmap('Spectral_r', 30),
-                         r'Column NO$_2$',
-                         geoscf_col_no2_month_ave[month,:,:], 
-                         'GEOS-CF', 0, 2.5e16, 
-                         geoscf_col_no2_month_ave.lon.values, 
-                         geoscf_col_no2_month_ave.lat.values,
-                         cm.get_cmap('Spectral_r', 30),
-                         r'Column NO$_2$',
-                         (r'Monthly Average Column NO$_2$ in ' 
-                          +calendar.month_name[month+1]+', '+year),
-                         -126, 25, -60, 53)
-    
-# plotting yearly average column NO2
-pf.Spatial_Plotting_2ax(tropomi_col_no2_year_ave[0,:,:], 
-                     'TROPOMI', 0, 2.5e16, 
-                     tropomi_col_no2_year_ave.lon.values, 
-                     tropomi_col_no2_year_ave.lat.values,
-                     cm.get_cmap('Spectral_r', 30),
-                     r'Column NO$_2$ (molecules/m$^2$)',
-                     geoscf_col_no2_year_ave[0,:,:], 
-                     'GEOS-CF', 0, 2.5e16, 
-                     geoscf_col_no2_year_ave.lon.values, 
-                     geoscf_col_no2_year_ave.lat.values,
-                     cm.get_cmap('Spectral_r', 30),
-                     r'Column NO$_2$ (molecules/m$^2$)',
-                     (r'Average Column NO$_2$ in '+year),  
-                     -126, 25, -60, 53)
+                      geoscf_surf_no2, geoscf_temp, partials=None):
+
+    if partials is None: 
+        partials = Daily_Partials(tropomi_col_no2, geoscf_col_no2, 
+                                  geoscf_surf_no2, geoscf_temp)
+
+    # monthly averages 
+    month = agg.Monthly_Means(partials)
+
+    # yearly averages 
+    year = agg.Yearly_Means(partials)
+
+    return (month.tropomi_col_no2, month.geoscf_col_no2, 
+            month.geoscf_surf_no2, month.geoscf_temp, 
+            year.tropomi_col_no2, year.geoscf_col_no2, 
+            year.geoscf_surf_no2, year.geoscf_temp)
+
+# monthly partial sums, counts, sums of squares and NO2-temperature...
+# ...cross-products, kept in a store that is only updated with the days...
+# ...added since the last run (see online_aggregates.py) 
+# the count index of days with TROPOMI data is extended the same way
+# if days already in the stores have changed (e.g. a late TROPOMI file...
+# ...for an earlier day) both stores are rebuilt from the whole record 
+# returns the paths of the two stores
+def Aggregates_Update(tropomi_col_no2, geoscf_col_no2_masked,
+                      geoscf_surf_no2_masked, geoscf_temp_masked):
+    daily = xr.Dataset({'tropomi_col_no2': tropomi_col_no2, 
+                        'geoscf_col_no2': geoscf_col_no2_masked,
+                        'geoscf_surf_no2': geoscf_surf_no2_masked,
+                        'geoscf_temp': geoscf_temp_masked})
+    changed = oa.Changed_Months(monthly_aggregates_path, daily)
+    if changed:
+        print('days changed in', ', '.join(changed), 'rebuilding', 
+              monthly_aggregates_path, 'and', valid_days_index_path)
+        for path in (monthly_aggregates_path, valid_days_index_path):
+            if os.path.exists(path):
+                os.remove(path)
+    oa.Aggregates_Update(monthly_aggregates_path, daily,
+                         products=no2_temp_products, verify=False)
+    vdi.Count_Index_Update(valid_days_index_path, tropomi_col_no2)
+    return [monthly_aggregates_path, valid_days_index_path]
 
 
 ######## Tallying the number of days of data per pixel for each month ########
 
-def Days_of_Data(tropomi_dataset): 
-    
-    # creating mask for locations of NaN values in TROPOMI array 
-    # nan locations are 1, all other data locations are 0
-    tropomi_dataset_copy = tropomi_dataset.copy(deep=True)
-    tropomi_mask = tropomi_dataset_copy.notnull()
-    
+# days of data per pixel are the valid-day counts of the TROPOMI...
+# ...monthly partials (see Count_Means), so the daily data is not...
+# ...scanned again 
+# partials from Daily_Partials can be passed in, otherwise they are...
+# ...found from tropomi_dataset 
+def Days_of_Data(tropomi_dataset, partials=None): 
+
+    if partials is None: 
+        partials = agg.Monthly_Partials(
+            xr.Dataset({'tropomi_col_no2': tropomi_dataset}))
+
     # tallying the number of days of data per pixel for each month 
-    days_with_data_month = tropomi_mask.resample(date='M').sum()
+    days_with_data_month = agg.Count_Means(partials).days
     # and for the whole year 
-    days_with_data_year = tropomi_mask.resample(date='Y').sum()
-    
-    return days_with_data_month, days_with_data_year
-
-# running function 
-days_with_data_month, days_with_data_year = Days_of_Data(tropomi_col_no2)
-
-############################## Plotting Data #################################
-# use spatial plotting functions from "plotting_functions.py"
-
-# individual months
-for month in range(12): 
-    monthly_data = days_with_data_month[month, :, :]
-    
-    # date for plot title 
-    date = days_with_data_month.date.values[month]
-    full_date = str(date)
-    year = full_date[0:4]
-    
-    pf.Spatial_Plotting_1ax(monthly_data, 0, 31,
-                         (r'Number of days with data in '
-                          +calendar.month_name[month+1]+', '+year), 
-                         monthly_data.lon.values, 
-                         monthly_data.lat.values, 
-                         -126, 25, -60, 53, 
-                         cm.get_cmap('Spectral_r', 30),
-                         'Number of Days')
-    
-# full year 
-
-# date for plot title 
-date = days_with_data_year.date.values[0]
-full_date = str(date)
-year = full_date[0:4]
-
-pf.Spatial_Plotting_1ax(days_with_data_year[0,:,:], 
-                     0, 365,
-                     (r'Number of days with data in '+year),  
-                     days_with_data_year.lon.values, 
-                     days_with_data_year.lat.values, 
-                     -126, 25, -60, 53, 
-                     cm.get_cmap('Spectral_r', 30),
-                     'Number of Days')
+    days_with_data_year = agg.Count_Means(agg.Yearly_Partials(partials)).days
 
+    return days_with_data_month, days_with_data_year
 
 
 ############# Masking gridboxes with <15 days of data in a month #############
@@ -162,62 +151,310 @@ pf.Spatial_Plotting_1ax(days_with_data_year[0,:,:],
 # gridboxes with sparse data may be noisy or biased 
 # masking, new data has names with "_gr15"
 
-def Masking_by_Days(tropomi_col_no2, tropomi_col_no2_month_ave, 
-                    geoscf_col_no2_month_ave, geoscf_surf_no2_month_ave, 
-                    geoscf_temp_month_ave):  
-    
-    tropomi_col_no2_copy = tropomi_col_no2.copy(deep=True)
-    tropomi_mask = tropomi_col_no2_copy.notnull()
-    days_with_data = tropomi_mask.resample(date='M').sum()
-    days_with_data_copy = days_with_data.copy(
-        deep=True)
-    days_with_data_nan = days_with_data_copy.where(
-        days_with_data_copy > 15)
-    day_number_mask = days_with_data_nan.notnull() 
-    
-    tropomi_col_no2_gr15 = xr.where(day_number_mask == True,
-                                    tropomi_col_no2_month_ave, 
-                                    days_with_data_nan)
-    geoscf_col_no2_gr15 = xr.where(day_number_mask == True, 
-                                   geoscf_col_no2_month_ave, 
-                                   days_with_data_nan)
-    geoscf_surf_no2_gr15 = xr.where(day_number_mask == True, 
-                                    geoscf_surf_no2_month_ave,
-                                    days_with_data_nan)
-    geoscf_temp_gr15 = xr.where(day_number_mask == True, 
-                                geoscf_col_no2_month_ave, 
-                                days_with_data_nan)
-    
-    return (tropomi_col_no2_gr15, geoscf_col_no2_gr15, geoscf_surf_no2_gr15, 
-            geoscf_temp_gr15)
-
-# testing function 
-(tropomi_col_no2_gr15, geoscf_col_no2_gr15, geoscf_surf_no2_gr15, 
- geoscf_temp_gr_15) = Masking_by_Days(tropomi_col_no2, 
-                                      tropomi_col_no2_month_ave, 
-                                      geoscf_col_no2_month_ave, 
-                                      geoscf_surf_no2_month_ave, 
-                                      geoscf_temp_month_ave)
-
-# plotting monthly average column NO2 with mask
-for month in range(12):
-    # date for plot title 
-    date = tropomi_col_no2_month_ave.date.values[month]
-    full_date = str(date)
-    year = full_date[0:4]
-    
-    pf.Spatial_Plotting_2ax(tropomi_col_no2_gr15[month,:,:], 
-                            'TROPOMI', 0, 2.5e16, 
-                             tropomi_col_no2_gr15.lon.values, 
-                             tropomi_col_no2_gr15.lat.values,
+# monthly averages are kept where TROPOMI has more than threshold days...
+# ...of data in the month, from the monthly partials of all four...
+# ...variables (e.g. from Daily_Partials) in one pass (see Count_Means) 
+def Masking_by_Days(partials, threshold=15):  
+
+    counted = agg.Count_Means(partials, threshold=threshold)
+
+    return (counted.tropomi_col_no2_thresholded, 
+            counted.geoscf_col_no2_thresholded, 
+            counted.geoscf_surf_no2_thresholded, 
+            counted.geoscf_temp_thresholded)
+
+
+############################ Rendering figures ###############################
+
+# frames of the monthly and yearly average column NO2 maps, the days of...
+# ...data maps and the masked (>15 days) monthly maps, all from the...
+# ...monthly partials (see batch_rendering.py)
+# year (e.g. 2020) gives the maps of the months of that year with data...
+# ...and of the whole year, None the maps of every year in the partials
+def Figure_Frames(partials, year=None):
+
+    years = sorted(set(partials.date.dt.year.values.tolist()))
+    if year is not None:
+        if int(year) not in years:
+            raise ValueError('no monthly partials in '+str(year)+
+                             ', the partials cover '+
+                             ', '.join(str(x) for x in years))
+        years = [int(year)]
+
+    frames = []
+    for year in years:
+        frames += Year_Frames(partials.sel(date=str(year)))
+    return frames
+
+# frames of the months of one year of partials and of the whole year
+# each month is titled and named from its own date, so a year that...
+# ...starts after January (e.g. TROPOMI from 2018-04-30) or a month...
+# ...appended later is drawn as itself
+def Year_Frames(partials):
+
+    (tropomi_col_no2_month_ave, geoscf_col_no2_month_ave,
+     geoscf_surf_no2_month_ave, geoscf_temp_month_ave,
+     tropomi_col_no2_year_ave, geoscf_col_no2_year_ave,
+     geoscf_surf_no2_year_ave, geoscf_temp_year_ave) = Temporal_Averages(
+         None, None, None, None, partials)
+    days_with_data_month, days_with_data_year = Days_of_Data(None, partials)
+    (tropomi_col_no2_gr15, geoscf_col_no2_gr15, geoscf_surf_no2_gr15,
+     geoscf_temp_gr_15) = Masking_by_Days(partials)
+    year = str(tropomi_col_no2_year_ave.date.values[0])[0:4]
+    # month names and numbers of the months in the partials
+    months = [(calendar.month_name[int(str(x)[5:7])], str(x)[5:7])
+              for x in partials.date.values]
+    frames = []
+
+    # monthly and yearly average column NO2
+    for i, (month_name, month) in enumerate(months):
+        frames.append(br.Map_Frame(
+            figure_path+'column_no2_'+year+'_'+month+'.png', 
+            (r'Monthly Average Column NO$_2$ in ' 
+             +month_name+', '+year), 
+            (tropomi_col_no2_month_ave[i,:,:], 'TROPOMI', 0, 2.5e16, 
+             r'Column NO$_2$'), 
+            (geoscf_col_no2_month_ave[i,:,:], 'GEOS-CF', 0, 2.5e16, 
+             r'Column NO$_2$')))
+    frames.append(br.Map_Frame(
+        figure_path+'column_no2_'+year+'.png', 
+        (r'Average Column NO$_2$ in '+year), 
+        (tropomi_col_no2_year_ave[0,:,:], 'TROPOMI', 0, 2.5e16, 
+         r'Column NO$_2$ (molecules/m$^2$)'), 
+        (geoscf_col_no2_year_ave[0,:,:], 'GEOS-CF', 0, 2.5e16, 
+         r'Column NO$_2$ (molecules/m$^2$)')))
+
+    # monthly and yearly days of data
+    for i, (month_name, month) in enumerate(months):
+        frames.append(br.Map_Frame(
+            figure_path+'days_with_data_'+year+'_'+month+'.png', 
+            (r'Number of days with data in ' 
+             +month_name+', '+year), 
+            (days_with_data_month[i,:,:], '', 0, 31, 'Number of Days')))
+    frames.append(br.Map_Frame(
+        figure_path+'days_with_data_'+year+'.png', 
+        (r'Number of days with data in '+year), 
+        (days_with_data_year[0,:,:], '', 0, 365, 'Number of Days')))
+
+    # monthly average column NO2 with mask
+    for i, (month_name, month) in enumerate(months):
+        frames.append(br.Map_Frame(
+            figure_path+'column_no2_gr15_'+year+'_'+month+'.png', 
+            (r'Monthly Average Column NO$_2$ in ' 
+             +month_name+', '+year), 
+            (tropomi_col_no2_gr15[i,:,:], 'TROPOMI', 0, 2.5e16, 
+             r'Column NO$_2$ (molecules/m$^2$)'), 
+            (geoscf_col_no2_gr15[i,:,:], 'GEOS-CF', 0, 2.5e16, 
+             r'Column NO$_2$ (molecules/m$^2$)')))
+
+    return frames
+
+# frames are rendered in parallel by headless worker processes straight...
+# ...to png files in figure_path, with simplified state/province...
+# ...boundaries and heavier coastlines and international borders
+# returns the filenames written
+def Figures_Render(frames, lat, lon):
+    states = read.Shapefile_Read(us_shapefile, can_shapefile, mex_shapefile,
+                                 simplify='conus')
+    return br.Render_Frames(frames, lat, lon, extent=(-126, 25, -60, 53),
+                            boundary_lines=br.Boundary_Lines(states),
+                            country_lines=br.Country_Lines(states))
+
+
+############################## Running Analysis ##############################
+
+if __name__ == '__main__':
+
+    if not batch_figures:
+        import matplotlib.cm as cm
+        import plotting_functions as pf
+
+    # reading in data
+    (tropomi_col_no2, geoscf_col_no2, geoscf_surf_no2, geoscf_temp,
+     geoscf_col_no2_masked, geoscf_surf_no2_masked,
+     geoscf_temp_masked) = Aligned_Read()
+
+    # adding the days since the last run to the stores
+    Aggregates_Update(tropomi_col_no2, geoscf_col_no2_masked,
+                      geoscf_surf_no2_masked, geoscf_temp_masked)
+    monthly_partials = oa.Aggregates_Read(monthly_aggregates_path)
+
+    # monthly and yearly means, variances and NO2-temperature covariances
+    monthly_moments = agg.Partial_Moments(monthly_partials)
+    yearly_moments = agg.Partial_Moments(agg.Yearly_Partials(monthly_partials))
+
+    # using function to obtain averaged datasets
+    (tropomi_col_no2_month_ave, geoscf_col_no2_month_ave,
+     geoscf_surf_no2_month_ave, geoscf_temp_month_ave,
+     tropomi_col_no2_year_ave, geoscf_col_no2_year_ave,
+     geoscf_surf_no2_year_ave, geoscf_temp_year_ave) = Temporal_Averages(
+         tropomi_col_no2, geoscf_col_no2_masked, geoscf_surf_no2_masked,
+         geoscf_temp_masked, monthly_partials)
+
+    # seasonal (DJF, MAM, JJA, SON) and multi-year climatological averages...
+    # ...from the same monthly partials
+    seasonal_ave = agg.Seasonal_Means(monthly_partials)
+    monthly_climatology = agg.Monthly_Climatology(monthly_partials)
+    seasonal_climatology = agg.Seasonal_Climatology(monthly_partials)
+
+    if not batch_figures:
+        # plotting monthly average column NO2
+        for month in range(12):
+            # date for plot title
+            date = tropomi_col_no2_month_ave.date.values[month]
+            full_date = str(date)
+            year = full_date[0:4]
+
+            pf.Spatial_Plotting_2ax(tropomi_col_no2_month_ave[month,:,:],
+                                 'TROPOMI', 0, 2.5e16,
+                                 tropomi_col_no2_month_ave.lon.values,
+                                 tropomi_col_no2_month_ave.lat.values,
+                                 cm.get_cmap('Spectral_r', 30),
+                                 r'Column NO$_2$',
+                                 geoscf_col_no2_month_ave[month,:,:],
+                                 'GEOS-CF', 0, 2.5e16, 
+                                 geoscf_col_no2_month_ave.lon.values,
+                                 geoscf_col_no2_month_ave.lat.values,
+                                 cm.get_cmap('Spectral_r', 30),
+                                 r'Column NO$_2$',
+                                 (r'Monthly Average Column NO$_2$ in ' 
+                                  +calendar.month_name[month+1]+', '+year),
+                                 -126, 25, -60, 53)
+
+        # plotting yearly average column NO2
+        pf.Spatial_Plotting_2ax(tropomi_col_no2_year_ave[0,:,:],
+                             'TROPOMI', 0, 2.5e16,
+                             tropomi_col_no2_year_ave.lon.values,
+                             tropomi_col_no2_year_ave.lat.values,
                              cm.get_cmap('Spectral_r', 30),
-                             r'Column NO$_2$ (molecules/m$^2$)', 
-                             geoscf_col_no2_gr15[month,:,:], 
+                             r'Column NO$_2$ (molecules/m$^2$)',
+                             geoscf_col_no2_year_ave[0,:,:],
                              'GEOS-CF', 0, 2.5e16, 
-                             geoscf_col_no2_gr15.lon.values, 
-                             geoscf_col_no2_gr15.lat.values,
+                             geoscf_col_no2_year_ave.lon.values,
+                             geoscf_col_no2_year_ave.lat.values,
                              cm.get_cmap('Spectral_r', 30),
-                             r'Column NO$_2$ (molecules/m$^2$)', 
-                             (r'Monthly Average Column NO$_2$ in ' 
-                             +calendar.month_name[month+1]+', '+year),
+                             r'Column NO$_2$ (molecules/m$^2$)',
+                             (r'Average Column NO$_2$ in '+year),
                              -126, 25, -60, 53)
+
+    # running function
+    days_with_data_month, days_with_data_year = Days_of_Data(
+        tropomi_col_no2, monthly_partials)
+
+    ############################ Plotting Data ###############################
+    # use spatial plotting functions from "plotting_functions.py"
+
+    if not batch_figures:
+        # individual months
+        for month in range(12):
+            monthly_data = days_with_data_month[month, :, :]
+
+            # date for plot title
+            date = days_with_data_month.date.values[month]
+            full_date = str(date)
+            year = full_date[0:4]
+
+            pf.Spatial_Plotting_1ax(monthly_data, 0, 31,
+                                 (r'Number of days with data in '
+                                  +calendar.month_name[month+1]+', '+year),
+                                 monthly_data.lon.values,
+                                 monthly_data.lat.values,
+                                 -126, 25, -60, 53,
+                                 cm.get_cmap('Spectral_r', 30),
+                                 'Number of Days')
+
+        # full year
+
+        # date for plot title 
+        date = days_with_data_year.date.values[0]
+        full_date = str(date)
+        year = full_date[0:4]
+
+        pf.Spatial_Plotting_1ax(days_with_data_year[0,:,:],
+                             0, 365,
+                             (r'Number of days with data in '+year),
+                             days_with_data_year.lon.values,
+                             days_with_data_year.lat.values,
+                             -126, 25, -60, 53, 
+                             cm.get_cmap('Spectral_r', 30),
+                             'Number of Days')
+
+    # days of data in any date window (seasons, heat waves, rolling...
+    # ...30-day windows) from the cumulative count index of TROPOMI data
+    # (see valid_days_index.py), e.g. days with data in summer 2020
+    days_with_data_summer = vdi.Window_Counts(valid_days_index_path,
+                                              '2020-06-01', '2020-08-31')
+
+    # testing function
+    (tropomi_col_no2_gr15, geoscf_col_no2_gr15, geoscf_surf_no2_gr15,
+     geoscf_temp_gr_15) = Masking_by_Days(monthly_partials, threshold=15)
+
+    # sensitivity of the masked averages to the day threshold: averages...
+    # ...and the fraction of pixels kept for thresholds of 5 to 25 days
+    threshold_sweep = agg.Threshold_Sweep(monthly_partials, range(5, 26))
+
+    if not batch_figures:
+        # plotting monthly average column NO2 with mask
+        for month in range(12):
+            # date for plot title
+            date = tropomi_col_no2_month_ave.date.values[month]
+            full_date = str(date)
+            year = full_date[0:4]
+
+            pf.Spatial_Plotting_2ax(tropomi_col_no2_gr15[month,:,:],
+                                    'TROPOMI', 0, 2.5e16,
+                                     tropomi_col_no2_gr15.lon.values,
+                                     tropomi_col_no2_gr15.lat.values,
+                                     cm.get_cmap('Spectral_r', 30),
+                                     r'Column NO$_2$ (molecules/m$^2$)',
+                                     geoscf_col_no2_gr15[month,:,:],
+                                     'GEOS-CF', 0, 2.5e16,
+                                     geoscf_col_no2_gr15.lon.values,
+                                     geoscf_col_no2_gr15.lat.values,
+                                     cm.get_cmap('Spectral_r', 30),
+                                     r'Column NO$_2$ (molecules/m$^2$)',
+                                     (r'Monthly Average Column NO$_2$ in '
+                                     +calendar.month_name[month+1]+', '+year),
+                                     -126, 25, -60, 53)
+
+
+    ############## Relationship between NO2 and temperature #################
+
+    # correlations (Pearson and Spearman) and least-squares slope of NO2...
+    # ...against temperature for every pixel (see temperature_regression.py)
+    surf_no2_temp_regression = tr.Pixel_Regression(geoscf_surf_no2_masked,
+                                                   geoscf_temp_masked)
+    col_no2_temp_regression = tr.Pixel_Regression(geoscf_col_no2_masked,
+                                                  geoscf_temp_masked)
+    tropomi_no2_temp_regression = tr.Pixel_Regression(tropomi_col_no2,
+                                                      geoscf_temp_masked)
+
+    # and separately for each season
+    surf_no2_temp_regression_season = tr.Pixel_Regression(
+        geoscf_surf_no2_masked, geoscf_temp_masked, group='season')
+
+
+    ################ Regional NO2 seasonality by state/province ##############
+
+    # states and provinces rasterised onto the grid once (see region_index.py)
+    region_index = ri.Region_Index(us_shapefile, can_shapefile, mex_shapefile,
+                                  tropomi_col_no2.lat.values,
+                                  tropomi_col_no2.lon.values)
+
+    # regional monthly, seasonal and climatological averages of every...
+    # ...variable, from the monthly partials
+    regional_partials = ri.Regional_Partials(monthly_partials, region_index)
+    regional_month_ave = agg.Monthly_Means(regional_partials)
+    regional_seasonal_ave = agg.Seasonal_Means(regional_partials)
+    regional_seasonal_climatology = agg.Seasonal_Climatology(
+        regional_partials)
+
+
+    ########################## Rendering figures #############################
+
+    # with batch_figures the maps are rendered in parallel to files
+    if batch_figures:
+        figure_files = Figures_Render(Figure_Frames(monthly_partials,
+                                                    figure_year),
+                                      tropomi_col_no2.lat.values,
+                                      tropomi_col_no2.lon.values)
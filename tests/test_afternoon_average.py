@@ -0,0 +1,79 @@
+import numpy as np
+import xarray as xr
+import geoscf_store as gs
+import geoscf_data_pull as gdp
+import geoscf_afternoon_averages as gaa
+
+
+# hourly UTC array on a small grid over the given hours
+def hourly_array(first, last):
+    times = np.arange(np.datetime64(first), np.datetime64(last),
+                      np.timedelta64(1, 'h')) + np.timedelta64(30, 'm')
+    lon = np.array([-120., -100., -80.])
+    values = np.arange(len(times) * 2 * 3, dtype=float).reshape(
+        (len(times), 2, 3))
+    return xr.DataArray(values, coords=[('time', times),
+                                        ('lat', [30., 40.]), ('lon', lon)])
+
+
+def test_mean_of_afternoon_hours():
+    array = hourly_array('2020-07-01T00', '2020-07-03T00')
+    afternoon = gaa.afternoon_average(array)
+    # at -80 (UTC-5) local 12-15 on July 1 are 17-20 UTC
+    expected = array.isel(time=slice(17, 21), lon=2).mean('time')
+    assert np.allclose(afternoon.sel(date='2020-07-01').isel(lon=2),
+                       expected)
+
+
+def test_no_hours_in_window_gives_no_dates():
+    # 06-10 UTC is between 22 and 05 local time at every longitude
+    array = hourly_array('2020-07-01T06', '2020-07-01T11')
+    for how in ('mean', 'max', 'count'):
+        afternoon = gaa.afternoon_average(array, how=how)
+        assert afternoon.sizes['date'] == 0
+        assert afternoon.sizes['lat'] == 2 and afternoon.sizes['lon'] == 3
+
+
+# pulls the hours of a month into a store and records it in the manifest
+def pull_month(monkeypatch, tmp_path, first, last, scale=1.):
+    monkeypatch.setattr(gdp, 'out_dir', str(tmp_path)+'/')
+    array = hourly_array(first, last) * scale
+    gs.store_write(gdp.store_filename('no2usa'), 'no2', array.values,
+                   array.time.values, array.lat.values, array.lon.values)
+    manifest_file = gdp.out_dir+'geocf_manifest.json'
+    manifest = gdp.load_manifest(manifest_file)
+    month = np.datetime64(first, 'M').astype(object)
+    manifest['no2usa_'+str(month.year)+str(month.month).zfill(2)] = \
+        gdp.month_entry('no2', 'no2usa', month.year, month.month, None)
+    gdp.save_manifest(manifest, manifest_file)
+
+
+def test_stream_recomputes_back_filled_and_re_pulled_months(tmp_path,
+                                                            monkeypatch):
+    store_path = str(tmp_path / 'geocf_no2usa.nc')
+    out_path = str(tmp_path / 'geocf_afternoon_ave_no2.nc')
+
+    pull_month(monkeypatch, tmp_path, '2020-12-01T00', '2021-01-01T00')
+    gaa.afternoon_stream(store_path, out_path, 'no2_ave')
+    assert gs.store_times(out_path, 'date')[0] == np.datetime64('2020-12-01')
+
+    # back-filling November merges it in before December
+    pull_month(monkeypatch, tmp_path, '2020-11-01T00', '2020-12-01T00')
+    gaa.afternoon_stream(store_path, out_path, 'no2_ave')
+    store = gs.store_open(store_path)
+    expected = gaa.afternoon_average(store.load())
+    store.close()
+    stored = gs.store_read(out_path).load()
+    assert stored.date.values[0] == np.datetime64('2020-11-01')
+    assert np.array_equal(stored.date.values, expected.date.values)
+    assert np.allclose(stored.values, expected.values, equal_nan=True)
+
+    # re-pulling November with corrected values recomputes it
+    pull_month(monkeypatch, tmp_path, '2020-11-01T00', '2020-12-01T00',
+               scale=2.)
+    gaa.afternoon_stream(store_path, out_path, 'no2_ave')
+    store = gs.store_open(store_path)
+    expected = gaa.afternoon_average(store.load())
+    store.close()
+    stored = gs.store_read(out_path).load()
+    assert np.allclose(stored.values, expected.values, equal_nan=True)
@@ -0,0 +1,21 @@
+import numpy as np
+import aligned_cache as cache
+
+
+def test_masks_differing_in_one_value_have_different_keys(tmp_path):
+    for name in ('no2', 'column', 'temp'):
+        (tmp_path / ('geocf_afternoon_ave_'+name+'.nc')).touch()
+    (tmp_path / 'tropomi').mkdir()
+    mask = np.ones((200, 300), dtype=bool)
+    other_mask = mask.copy()
+    other_mask[100, 150] = False
+
+    def key(extra_masks):
+        return cache.Read_Cache_Key(str(tmp_path)+'/',
+                                    str(tmp_path / 'tropomi'),
+                                    str(tmp_path / 'cache'),
+                                    {'extra_masks': extra_masks})[0]
+
+    assert repr(mask) == repr(other_mask)
+    assert key((mask,)) != key((other_mask,))
+    assert key((mask,)) == key((mask.copy(),))
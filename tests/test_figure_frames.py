@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import temporal_averaging as ta
+
+
+# monthly partials of daily data from 2018-04-30 (the first TROPOMI day)
+def partials_from_april():
+    dates = pd.date_range('2018-04-30', '2019-02-28')
+    rng = np.random.default_rng(0)
+    arrays = []
+    for i in range(4):
+        values = rng.random((len(dates), 2, 3))
+        values[values < 0.3] = np.nan
+        arrays.append(xr.DataArray(values, coords=[('date', dates),
+                                                   ('lat', [30., 40.]),
+                                                   ('lon', [-120., -100.,
+                                                            -80.])]))
+    return ta.Daily_Partials(*arrays)
+
+
+def test_frames_are_titled_from_their_dates():
+    partials = partials_from_april()
+    frames = ta.Figure_Frames(partials, 2018)
+    titles = [x['title'] for x in frames if 'column_no2_2018' in
+              x['filename'] and 'gr15' not in x['filename']]
+    assert titles[0] == r'Monthly Average Column NO$_2$ in April, 2018'
+    assert titles[-2] == r'Monthly Average Column NO$_2$ in December, 2018'
+    assert titles[-1] == r'Average Column NO$_2$ in 2018'
+    # nine months with three maps each and two yearly maps
+    assert len(frames) == 9 * 3 + 2
+
+    # the yearly map of 2019 is the mean of January and February 2019
+    frames = ta.Figure_Frames(partials, 2019)
+    yearly = [x for x in frames
+              if x['filename'].endswith('column_no2_2019.png')]
+    expected = partials.sel(date='2019').tropomi_col_no2_sum.sum('date') / (
+        partials.sel(date='2019').tropomi_col_no2_count.sum('date'))
+    assert np.allclose(yearly[0]['panels'][0]['values'], expected,
+                       equal_nan=True)
+
+    assert len(ta.Figure_Frames(partials)) == 9 * 3 + 2 + 2 * 3 + 2
+    with pytest.raises(ValueError):
+        ta.Figure_Frames(partials, 2020)
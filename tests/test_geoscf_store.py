@@ -0,0 +1,35 @@
+import numpy as np
+import geoscf_store as gs
+
+
+lat = np.arange(3.)
+lon = np.arange(4.)
+
+
+def test_interleaved_merge_keeps_every_variable_aligned(tmp_path):
+    store_path = str(tmp_path / 'store.nc')
+    times = np.arange('2020-11-01', '2021-01-01', dtype='datetime64[h]')
+    values = np.random.default_rng(0).random((len(times), 3, 4))
+    afternoon = np.isin(times.astype(np.int64) % 24, [16, 17, 18])
+    november = times < np.datetime64('2020-12-01')
+
+    # both variables pulled for some hours of each day of both months
+    gs.store_write(store_path, 'no2', values[afternoon], times[afternoon],
+                   lat, lon, chunk_times=7)
+    gs.store_write(store_path, 't10m', -values[afternoon], times[afternoon],
+                   lat, lon, chunk_times=7)
+
+    # no2 re-pulled with all hours of November, interleaved with the...
+    # ...stored hours, and December moved back a few rows at a time
+    gs.store_write(store_path, 'no2', values[november], times[november],
+                   lat, lon, chunk_times=7)
+
+    kept = november | afternoon
+    assert np.array_equal(gs.store_times(store_path),
+                          times[kept].astype('datetime64[s]'))
+    assert np.allclose(gs.store_read(store_path, 'no2').values, values[kept])
+
+    # t10m keeps its values at its own hours and is NaN at the new hours
+    t10m = gs.store_read(store_path, 't10m').values
+    assert np.allclose(t10m[afternoon[kept]], -values[afternoon])
+    assert np.isnan(t10m[~afternoon[kept]]).all()
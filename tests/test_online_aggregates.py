@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import geoscf_store as gs
+import online_aggregates as oa
+import temporal_aggregation as agg
+import temporal_averaging as ta
+
+
+def daily_dataset(first, last, seed=0):
+    dates = pd.date_range(first, last)
+    values = np.random.default_rng(seed).random((len(dates), 3, 4))
+    values[values < 0.3] = np.nan
+    return xr.Dataset({'no2': (('date', 'lat', 'lon'), values)},
+                      coords={'date': dates, 'lat': np.arange(3.),
+                              'lon': np.arange(4.)})
+
+
+def test_update_in_parts_matches_one_pass(tmp_path):
+    store_path = str(tmp_path / 'aggregates.nc')
+    daily = daily_dataset('2020-01-01', '2020-03-31')
+    assert oa.Aggregates_Update(store_path,
+                                daily.sel(date=slice(None, '2020-02-10'))) == 41
+    assert oa.Aggregates_Update(store_path, daily) == len(daily.date) - 41
+    assert oa.Aggregates_Update(store_path, daily) == 0
+
+    stored = oa.Aggregates_Read(store_path)
+    expected = agg.Monthly_Partials(daily, squares=True)
+    for name in expected.data_vars:
+        assert np.allclose(stored[name].values, expected[name].values)
+    assert oa.Aggregates_Last_Date(store_path) == np.datetime64(
+        '2020-03-31T00:00:00')
+
+
+def test_interrupted_first_build_is_reported(tmp_path, monkeypatch):
+    store_path = str(tmp_path / 'aggregates.nc')
+    store_write = gs.store_write
+    calls = []
+
+    # the build stops after the first partial has been written
+    def interrupted_write(*args, **kwargs):
+        if calls:
+            raise KeyboardInterrupt
+        calls.append(args[1])
+        store_write(*args, **kwargs)
+
+    monkeypatch.setattr(gs, 'store_write', interrupted_write)
+    with pytest.raises(KeyboardInterrupt):
+        oa.Aggregates_Update(store_path, daily_dataset('2020-01-01',
+                                                       '2020-01-31'))
+
+    with pytest.raises(ValueError, match='interrupted'):
+        oa.Aggregates_Last_Date(store_path)
+
+
+def test_changed_day_is_found_and_rebuilds(tmp_path, monkeypatch):
+    store_path = str(tmp_path / 'aggregates.nc')
+    daily = daily_dataset('2020-01-01', '2020-03-31')
+    oa.Aggregates_Update(store_path,
+                         daily.sel(date=slice(None, '2020-02-10')))
+    assert oa.Changed_Months(store_path, daily) == []
+
+    # a late file for a day already added
+    late = daily.copy(deep=True)
+    late['no2'][20] = 1.
+    assert oa.Changed_Months(store_path, late) == ['2020-01']
+    with pytest.raises(ValueError):
+        oa.Aggregates_Update(store_path, late)
+
+    # the script's update rebuilds both stores from the whole record
+    monkeypatch.setattr(ta, 'monthly_aggregates_path', store_path)
+    monkeypatch.setattr(ta, 'valid_days_index_path',
+                        str(tmp_path / 'index.nc'))
+    arrays = [late.no2.rename(x) for x in ('tropomi_col_no2',
+                                            'geoscf_col_no2',
+                                            'geoscf_surf_no2', 'geoscf_temp')]
+    ta.Aggregates_Update(*arrays)
+    late_arrays = [x.copy(deep=True) for x in arrays]
+    for array in late_arrays:
+        array[5] = 2.
+    ta.Aggregates_Update(*late_arrays)
+
+    stored = oa.Aggregates_Read(store_path)
+    expected = agg.Monthly_Partials(
+        xr.Dataset({x.name: x for x in late_arrays}), squares=True,
+        products=ta.no2_temp_products)
+    for name in expected.data_vars:
+        assert np.allclose(stored[name].values, expected[name].values)
+    index = gs.store_read(ta.valid_days_index_path).values
+    assert np.array_equal(index[-1],
+                          late_arrays[0].notnull().sum('date').values)
@@ -0,0 +1,50 @@
+from pathlib import Path
+import geoscf_data_pull as gdp
+import geoscf_afternoon_averages as gaa
+import pipeline
+
+
+def test_afternoon_reads_the_pull_directory():
+    assert gaa.geoscf_usa_path == Path(gdp.out_dir)
+
+
+def test_pull_output_change_reruns_afternoon(tmp_path, monkeypatch):
+    monkeypatch.setattr(gdp, 'out_dir', str(tmp_path)+'/')
+    monkeypatch.setattr(gaa, 'geoscf_usa_path', tmp_path)
+    afternoon_output = str(tmp_path / 'geocf_afternoon_ave_no2.nc')
+    runs = []
+
+    def pull_run():
+        for collection in gdp.collections:
+            with open(gdp.store_filename(collection[2]), 'a') as file_out:
+                file_out.write('timestep\n')
+        with open(gdp.out_dir+'geocf_manifest.json', 'w') as file_out:
+            file_out.write('{}')
+
+    def afternoon_run():
+        runs.append('afternoon')
+        with open(afternoon_output, 'w') as file_out:
+            file_out.write('average')
+
+    stages = [
+        {'name': 'pull',
+         'inputs': lambda: [],
+         'params': lambda: [],
+         'outputs': pipeline.Pull_Outputs,
+         'run': pull_run},
+        {'name': 'afternoon',
+         'inputs': pipeline.Afternoon_Inputs,
+         'params': lambda: [],
+         'outputs': lambda: [afternoon_output],
+         'run': afternoon_run}]
+    state_path = str(tmp_path / 'state' / 'pipeline_state.json')
+
+    assert set(pipeline.Run_Pipeline(stages, state_path=state_path)) == \
+        {'pull', 'afternoon'}
+    assert pipeline.Run_Pipeline(stages, state_path=state_path) == {}
+
+    # a re-pulled month rewrites a store, which reruns the afternoon stage
+    assert set(pipeline.Run_Pipeline(stages, force=['pull'],
+                                     state_path=state_path)) == \
+        {'pull', 'afternoon'}
+    assert runs == ['afternoon', 'afternoon']
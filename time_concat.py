@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 13:05:52 2026
+
+@author: rhmooers
+"""
+
+##### Linear-Time Concatenation of Per-File Arrays #####
+
+# replaces the pattern
+#     arr = list[0]
+#     for i in range(1, n): arr = xr.concat([arr, list[i]], dim='time')
+# which copies everything accumulated so far on every iteration...
+# ...(quadratic in the number of files)
+# here the length of each file along the time axis is found first...
+# ...(from the array shapes, without reading any data), the output is...
+# ...allocated once and each file's values are copied into their slot
+
+import numpy as np
+import xarray as xr
+import time
+
+
+# function to concatenate a list of xarrays along one dimension
+# the arrays may be lazily loaded (e.g. from xr.open_dataset), each is...
+# ...read once, straight into its slot of the output
+# all other dimensions and coordinates are taken from the first array
+def concat_time(array_list, dim='time'):
+
+    first = array_list[0]
+    axis = first.dims.index(dim)
+
+    # discovering the per-file lengths
+    lengths = [array.sizes[dim] for array in array_list]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    for array in array_list:
+        if array.dims != first.dims:
+            raise ValueError('arrays have different dimensions: '+
+                             str(array.dims)+' and '+str(first.dims))
+
+    shape = list(first.shape)
+    shape[axis] = offsets[-1]
+    dtype = np.result_type(*[array.dtype for array in array_list])
+
+    # preallocating the output once and filling it
+    values = np.empty(shape, dtype=dtype)
+    for i, array in enumerate(array_list):
+        slot = [slice(None)] * len(shape)
+        slot[axis] = slice(offsets[i], offsets[i+1])
+        values[tuple(slot)] = array.values
+
+    coords = {name: coord for name, coord in first.coords.items()
+              if dim not in coord.dims}
+    if all(dim in array.coords for array in array_list):
+        coords[dim] = np.concatenate([array[dim].values
+                                      for array in array_list])
+
+    return xr.DataArray(values, dims=first.dims, coords=coords,
+                        name=first.name, attrs=first.attrs)
+
+
+# function to compare repeated xr.concat with concat_time
+# prints the time taken by each for n_files files of file_shape...
+# ...showing the quadratic growth of the repeated concatenation and the...
+# ...linear growth of concat_time
+def concat_benchmark(n_files_list=(8, 16, 32, 64, 128),
+                     file_shape=(24, 140, 265)):
+
+    for n_files in n_files_list:
+        array_list = []
+        for i in range(n_files):
+            times = (np.datetime64('2020-01-01T00:30') + np.arange(
+                i*file_shape[0], (i+1)*file_shape[0]).astype(
+                    'timedelta64[h]'))
+            array_list.append(xr.DataArray(
+                np.random.rand(*file_shape), dims=('time', 'lat', 'lon'),
+                coords={'time': times}))
+
+        start = time.perf_counter()
+        array = array_list[0]
+        for i in range(1, len(array_list)):
+            array = xr.concat([array, array_list[i]], dim='time')
+        repeated = time.perf_counter() - start
+
+        start = time.perf_counter()
+        concat_time(array_list)
+        linear = time.perf_counter() - start
+
+        print(n_files, 'files: repeated xr.concat', round(repeated, 3),
+              's, concat_time', round(linear, 3), 's')
+
+
+if __name__ == '__main__':
+    concat_benchmark()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:22:10 2026
+
+@author: rhmooers
+"""
+
+##### Persistent Catalogue of Regridded TROPOMI Files #####
+
+# records the date, grid bounds, shape and modification time of every...
+# ...daily TROPOMI file in a JSON file in the user's cache directory...
+# ...(the shared TROPOMI directory may not be writable)
+# the directory is listed once per run and only new or changed files...
+# ...are opened, so reading the record no longer re-scans hundreds of...
+# ...files, and each file's data is tied to its own date rather than...
+# ...to its position in a list of consecutive days
+
+import numpy as np
+import netCDF4
+import hashlib
+import json
+import os
+from datetime import datetime
+
+
+# function to give the default catalogue path for a TROPOMI directory
+# a file in cache_path (e.g. read.cache_path) named by a hash of the...
+# ...absolute path of the directory, so each directory has its own
+def Catalogue_Path(tropomi_files_path, cache_path):
+    key = hashlib.sha256(os.path.abspath(tropomi_files_path).encode()
+                         ).hexdigest()[:16]
+    return os.path.join(cache_path, 'tropomi_catalogue_'+key+'.json')
+
+
+# function to read the metadata of one TROPOMI file
+# only the lat/lon coordinates and the shape of the value field are read
+# the date is parsed from the filename (8 characters before '.nc')
+def File_Entry(filepath, date_format):
+    filename = os.path.basename(filepath)
+    date = datetime.strptime(filename[-11:-3], date_format)
+    with netCDF4.Dataset(filepath, 'r') as nc:
+        lat = nc['lat'][:]
+        lon = nc['lon'][:]
+        shape = nc['value'].shape
+    file_stat = os.stat(filepath)
+    return {'date': date.strftime('%Y-%m-%d'),
+            'min_lat': float(np.min(lat)), 'max_lat': float(np.max(lat)),
+            'min_lon': float(np.min(lon)), 'max_lon': float(np.max(lon)),
+            'shape': list(shape),
+            'mtime': file_stat.st_mtime, 'size': file_stat.st_size}
+
+
+# function to build or update the catalogue of a TROPOMI directory
+# files whose modification time and size are unchanged keep their entry...
+# ...new or changed files are opened, removed files are dropped
+# catalogue_file is the JSON file of the catalogue (see Catalogue_Path)
+# date_format is the format of the date in the filenames
+# returns {filename: entry} with the catalogue saved if anything changed
+def Tropomi_Catalogue(tropomi_files_path, catalogue_file,
+                      date_format='%Y%d%m'):
+
+    catalogue = {}
+    if os.path.exists(catalogue_file):
+        with open(catalogue_file) as file_in:
+            catalogue = json.load(file_in)
+
+    changed = False
+    filenames = [x for x in os.listdir(tropomi_files_path)
+                 if x.endswith('.nc')]
+    for filename in filenames:
+        filepath = os.path.join(tropomi_files_path, filename)
+        file_stat = os.stat(filepath)
+        entry = catalogue.get(filename)
+        if (entry is not None and entry['mtime'] == file_stat.st_mtime
+                and entry['size'] == file_stat.st_size):
+            continue
+        catalogue[filename] = File_Entry(filepath, date_format)
+        changed = True
+
+    for filename in set(catalogue) - set(filenames):
+        del catalogue[filename]
+        changed = True
+
+    if changed:
+        os.makedirs(os.path.dirname(os.path.abspath(catalogue_file)),
+                    exist_ok=True)
+        with open(catalogue_file+'.tmp', 'w') as file_out:
+            json.dump(catalogue, file_out, indent=1, sort_keys=True)
+        os.replace(catalogue_file+'.tmp', catalogue_file)
+
+    return catalogue
+
+
+# function to list catalogued filenames and dates in date order
+# start and end (dates or strings, inclusive) limit the dates returned
+def Catalogue_Files(catalogue, start=None, end=None):
+    filenames = sorted(catalogue, key=lambda x: catalogue[x]['date'])
+    dates = np.array([catalogue[x]['date'] for x in filenames],
+                     dtype='datetime64[D]')
+    keep = np.ones(len(filenames), dtype=bool)
+    if start is not None:
+        keep &= dates >= np.datetime64(start, 'D')
+    if end is not None:
+        keep &= dates <= np.datetime64(end, 'D')
+    return [x for x, k in zip(filenames, keep) if k], dates[keep]
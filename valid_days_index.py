@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:31:05 2026
+
+@author: rhmooers
+"""
+
+##### Cumulative Count Index of Days with TROPOMI Data #####
+
+# for every pixel and date the index holds the number of days with data...
+# ...from the start of the record up to and including that date
+# the number of days with data in any window [start, end] is then the...
+# ...index at end minus the index on the day before start, reading only...
+# ...two days of the index instead of the daily data of the whole window
+# the index is a store (see geoscf_store.py) with a date axis, so new...
+# ...days are appended without recounting the days already indexed
+# counts are stored as float32, which holds whole numbers exactly up to...
+# ...16,777,216 (far more days than the record)
+
+import numpy as np
+import xarray as xr
+import geoscf_store as gs
+
+
+# name of the variable in the index store
+index_variable = 'valid_days'
+
+
+# function to build or extend the index from a daily array (date, lat, lon)
+# validity is where the array is not NaN (e.g. TROPOMI column NO2)
+# only dates after the last date in the index are added...
+# ...chunk_days days at a time, so the array may be lazily loaded
+# returns the number of dates added
+def Count_Index_Update(index_path, daily_array, chunk_days=31):
+
+    index_dates = gs.store_times(index_path, 'date')
+    dates = daily_array.date.values.astype('datetime64[s]')
+    first = 0
+    running = np.zeros(daily_array.shape[1:])
+    if len(index_dates):
+        first = np.searchsorted(dates, index_dates[-1], side='right')
+        last_row = gs.store_open(index_path, index_variable)
+        running = last_row.isel(date=-1).values.astype(np.float64)
+        last_row.close()
+
+    for start in range(first, len(dates), chunk_days):
+        block = daily_array.isel(date=slice(start, start+chunk_days)).values
+        counts = np.cumsum(~np.isnan(block), axis=0) + running
+        running = counts[-1]
+        gs.store_write(index_path, index_variable, counts,
+                       dates[start:start+chunk_days],
+                       daily_array.lat.values, daily_array.lon.values,
+                       time_dim='date', float32=True, chunk_times=chunk_days)
+
+    return len(dates) - first
+
+
+# function to find the index rows bounding windows [start, end]
+# returns the row of each end and of the day before each start...
+# ...(-1 before the first date of the index)
+def Window_Rows(index_dates, starts, ends):
+    starts = np.atleast_1d(np.asarray(starts, dtype='datetime64[s]'))
+    ends = np.atleast_1d(np.asarray(ends, dtype='datetime64[s]'))
+    end_rows = np.searchsorted(index_dates, ends, side='right') - 1
+    start_rows = np.searchsorted(index_dates, starts, side='left') - 1
+    return start_rows, end_rows
+
+
+# function to count the days with data per pixel in date windows
+# starts and ends are dates (or lists of dates) giving inclusive windows...
+# ...e.g. ('2020-06-01', '2020-08-31') or seasons, heat waves, etc.
+# only the rows of the index bounding each window are read
+# returns a (lat, lon) array for a single window, otherwise an array...
+# ...with a window dimension
+def Window_Counts(index_path, starts, ends):
+
+    index_dates = gs.store_times(index_path, 'date')
+    start_rows, end_rows = Window_Rows(index_dates, starts, ends)
+
+    # reading each needed row once
+    rows = np.unique(np.concatenate([start_rows, end_rows]))
+    rows = rows[rows >= 0]
+    index = gs.store_open(index_path, index_variable)
+    values = index.isel(date=rows).values.astype(np.float64)
+    lat = index.lat.values
+    lon = index.lon.values
+    index.close()
+
+    # days before the index start with a count of 0
+    values = np.concatenate([np.zeros((1,) + values.shape[1:]), values])
+    position = np.searchsorted(rows, start_rows) + 1
+    position[start_rows < 0] = 0
+    before = values[position]
+    after = values[np.searchsorted(rows, end_rows) + 1]
+    after[end_rows < 0] = 0
+
+    counts = xr.DataArray(np.maximum(after - before, 0).astype(np.int32),
+                          dims=('window', 'lat', 'lon'),
+                          coords={'lat': lat, 'lon': lon,
+                                  'start': ('window', np.atleast_1d(
+                                      np.asarray(starts, 'datetime64[D]'))),
+                                  'end': ('window', np.atleast_1d(
+                                      np.asarray(ends, 'datetime64[D]')))},
+                          name=index_variable)
+    if np.ndim(starts) == 0 and np.ndim(ends) == 0:
+        counts = counts.isel(window=0)
+    return counts
+
+
+# function to count the days with data per pixel in the window of...
+# ...length days ending on each date of the index (e.g. 30-day windows)
+# reads the whole index, a date's window starts days-1 days earlier
+def Rolling_Counts(index_path, days=30):
+    index = gs.store_open(index_path, index_variable)
+    cumulative = index.values.astype(np.float64)
+    dates = index.date.values.astype('datetime64[s]')
+    start_rows, end_rows = Window_Rows(
+        dates, dates - np.timedelta64(days-1, 'D'), dates)
+    before = np.where((start_rows >= 0)[:, None, None],
+                      cumulative[np.maximum(start_rows, 0)], 0)
+    rolling = xr.DataArray((cumulative - before).astype(np.int32),
+                           dims=index.dims,
+                           coords={x: index[x].values for x in index.dims},
+                           name=index_variable)
+    index.close()
+    return rolling